@@ -15,20 +15,71 @@ from __future__ import division
 import random
 import scipy
 import numpy as np
-import topo_type
 import textwrap
 import scipy.io
+import scipy.sparse.csgraph
 import time
-import topo_xml
+import topo_dist
+import topo_path
 import networkx as nx
+import shutil
 
 TOPO_PATH = "/Users/xuanliu/Documents/projects/dynrec/modeling/formulation/dynrec-modeling/topology/"
 
+
+class data_writer(object):
+    """
+    A buffered writer for one ampl data file. 
+    The file is opened once per scenario and every print_* function writes 
+    its section through the same handle, in the order they are called, 
+    instead of reopening the file in append mode for each section.
+    """
+    def __init__(self, data_file, mode='a', buf_size=1 << 16):
+        """
+        Open the data file, mode 'w' starts a new file and mode 'a' appends
+        to an existing one (i.e. a copy of the template data file)
+        """
+        self.data_file = data_file
+        self.fopen = open(data_file, mode, buf_size)
+        
+    def write(self, to_print):
+        ''' write a section into the buffer '''
+        self.fopen.write(to_print)
+        
+    def close(self):
+        ''' flush the buffer and close the data file '''
+        if not self.fopen.closed:
+            self.fopen.close()
+            
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_data(data_file, mode='a'):
+    """
+    Return a writer for the data file. If a data_writer is given, it is 
+    shared as is, otherwise the file is opened for this section only.
+    """
+    if isinstance(data_file, data_writer):
+        return data_file
+    return open(data_file, mode)
+    
+def close_data(fopen, data_file):
+    """
+    Close the handle returned by open_data(), a shared data_writer is left 
+    open for the next section
+    """
+    if fopen is not data_file:
+        fopen.close()
+
 def print_header(ampl_data_file):
     """
     print the description information about the ampl data file
     """
-    fopen = open(ampl_data_file, 'w')
+    fopen = open_data(ampl_data_file, 'w')
     file_timestamp = time.ctime()    
     header = """
     ### -------------------------
@@ -43,14 +94,51 @@ def print_header(ampl_data_file):
     ### ------------------------
     """.format(file_timestamp)
     fopen.write(header)
-    fopen.close()
+    close_data(fopen, ampl_data_file)
+    
+def print_overlay_header(base_data_file, ampl_data_file):
+    """
+    print the header of a scenario overlay data file. The overlay only 
+    contains the sections that change with the scenario, the invariant 
+    sections are in the base data file, which has to be loaded first:
+        data <base_data_file>; data <ampl_data_file>;
+    lp_gen.sh reads the base data file name from the first line.
+    """
+    fopen = open_data(ampl_data_file, 'w')
+    header = """# base data file: {0}
+    ### -------------------------
+    #
+    # This is a scenario overlay data file for ampl, load it
+    # after the base data file given above.
+    # 
+    # {1}
+    ### ------------------------
+    """.format(base_data_file, time.ctime())
+    fopen.write(header)
+    close_data(fopen, ampl_data_file)
+    
+def scenario_writer(base_data_file, data_file, overlay=False):
+    """
+    Return the data_writer for a scenario data file. 
+    overlay = False: the scenario file starts as a full copy of the base 
+    (template) data file, and the scenario sections are appended to it.
+    overlay = True: the scenario file only holds the scenario sections,
+    and refers to the base data file written once by run().
+    """
+    if overlay:
+        data_out = data_writer(data_file, 'w')
+        print_overlay_header(base_data_file, data_out)
+    else:
+        shutil.copyfile(base_data_file, data_file)
+        data_out = data_writer(data_file)
+    return data_out
     
 def print_index_bound(model, ampl_data_file):
     """
     Print the index bound information
     The input is the model object created in create_model.py
     """
-    fopen = open(ampl_data_file, 'a')
+    fopen = open_data(ampl_data_file)
     
     to_print = """
     ### ------ Index bound declaration ------- ###
@@ -59,7 +147,7 @@ def print_index_bound(model, ampl_data_file):
     """.format(len(model.snet_nodes), len(model.vnets))
     
     fopen.write(to_print)
-    fopen.close()
+    close_data(fopen, ampl_data_file)
 
 
 
@@ -93,9 +181,9 @@ def set_info(model, ampl_data_file):
     {0}
     """.format(failed_set_str)
 
-    fopen = open(ampl_data_file, 'a')
+    fopen = open_data(ampl_data_file)
     fopen.write(to_print)
-    fopen.close()
+    close_data(fopen, ampl_data_file)
     
     return failed
     #para_beta(failed, model, data_file)
@@ -139,9 +227,9 @@ def print_num_ports(model, ampl_data_file):
     {0}\t;
     """.format(snode_ports)
     
-    fopen = open(ampl_data_file, 'a')
+    fopen = open_data(ampl_data_file)
     fopen.write(to_print)
-    fopen.close()
+    close_data(fopen, ampl_data_file)
 
 def print_vnode_viface(model, ampl_data_file):
     """
@@ -180,9 +268,9 @@ def print_vnode_viface(model, ampl_data_file):
     {1}\t;
     """.format(vnet_index, vnode_viface)
     
-    fopen = open(ampl_data_file, 'a')
+    fopen = open_data(ampl_data_file)
     fopen.write(to_print)
-    fopen.close()
+    close_data(fopen, ampl_data_file)
     
     
 def print_bw(model, ampl_data_file):
@@ -192,37 +280,24 @@ def print_bw(model, ampl_data_file):
     used by a substrate node.    
     """
     
-    snet_info = model.get_snet_info()
-    # get the maximum number of interfaces used by a substrate node
-    # this maximum number indicates how many rows will be in the matrix    
-    iface_by_node = []
-    for item in snet_info:
-        iface_by_node.append(snet_info[item]['num_iface'])
-    max_ifaces = max(iface_by_node)
+    # rows are ports, columns are substrate nodes, NaN for no such port
+    # the maximum number of interfaces used by a substrate node 
+    # indicates how many rows will be in the matrix    
+    bw_m = model.snet_state.bw_matrix()
+    max_ifaces = len(bw_m)
     
     node_index = []
-    for item in snet_info:
+    for item in range(model.snet_state.num_nodes()):
         node_index.append(str(item + 1))
     node_index_str = '\t\t'.join(node_index)
     
     matrx_str = ''
-    bw_m = []
     for index in range(0, max_ifaces):
-        iface_bw_list = []
-        for item in snet_info:
-            if index < snet_info[item]['num_iface']:
-                #iface_bw = round(snet_info[item]['ifaces'][index]['avail_bw'], 5)
-                iface_bw = str(round(snet_info[item]['ifaces'][index]['avail_bw'], 5))
-            else:
-                #iface_bw = 0
-                iface_bw = '.'
-            iface_bw_list.append(iface_bw)
-            #iface_bw_list.append(str(iface_bw))
+        iface_bw_list = [num2str(iface_bw) for iface_bw in bw_m[index]]
         if index == 0:
             matrx_str += '\t\t' + str(index + 1) + '\t\t' + '\t\t'.join(iface_bw_list) + '\n'
         else:
             matrx_str += '\t\t\t' + str(index + 1) + '\t\t' + '\t\t'.join(iface_bw_list) + '\n'
-        bw_m.append(iface_bw_list)
     
 
     to_print = """
@@ -234,9 +309,9 @@ def print_bw(model, ampl_data_file):
     {1}\t;
     """.format(node_index_str, matrx_str)
     
-    fopen = open(ampl_data_file, 'a')
+    fopen = open_data(ampl_data_file)
     fopen.write(to_print)
-    fopen.close()
+    close_data(fopen, ampl_data_file)
     #print "bw", bw_m
     return bw_m
     
@@ -283,9 +358,9 @@ def print_indicator(model, ampl_data_file):
     {1}\t;
     """.format(node_index_str, alpha_matrix_str)
     
-    fopen = open(ampl_data_file, 'a')
+    fopen = open_data(ampl_data_file)
     fopen.write(to_print)
-    fopen.close()
+    close_data(fopen, ampl_data_file)
     
 def print_delta(model, ampl_data_file):
     """
@@ -318,9 +393,9 @@ def print_delta(model, ampl_data_file):
     {1}\t;
     """.format(node_index_str, delta_matrix_str)
     
-    fopen = open(ampl_data_file, 'a')
+    fopen = open_data(ampl_data_file)
     fopen.write(to_print)
-    fopen.close()
+    close_data(fopen, ampl_data_file)
                 
 def print_beta(model, ampl_data_file):
     """
@@ -351,9 +426,9 @@ def print_beta(model, ampl_data_file):
     param beta (tr):   {0} :=
     {1}\t;
     """.format(node_index_str, beta_matrix_str)
-    fopen = open(ampl_data_file, 'a')
+    fopen = open_data(ampl_data_file)
     fopen.write(to_print)
-    fopen.close()
+    close_data(fopen, ampl_data_file)
                
 def print_limit(model, ampl_data_file, limit='inf'):
     """
@@ -386,47 +461,54 @@ def print_limit(model, ampl_data_file, limit='inf'):
     {0}\t;
     """.format(matrix_str)
     
-    fopen = open(ampl_data_file, 'a')
+    fopen = open_data(ampl_data_file)
     fopen.write(to_print)
-    fopen.close() 
+    close_data(fopen, ampl_data_file)
         
 def print_e(model, ampl_data_file):
     ''' print connectivity information e '''
     e_header = 'param e :=\n'
     vn_list = model.vnets
-    fopen = open(ampl_data_file, 'a')
+    fopen = open_data(ampl_data_file)
     fopen.write(e_header)
     for vnet in vn_list:
         sub_header = ['[' + str(vnet.vnet_id) + ', *, *]:']
         vnodeid = map(str, range(1, len(vnet.vnodes)+1))
         sub_header.extend(vnodeid)
         sub_header.append(':=\n')
-        sub_matrix = scipy.zeros((len(vnet.vnodes), len(vnet.vnodes)), 
-                                 dtype = object)
-        for i in range(len(vnet.vnodes)):
-            for j in range(len(vnet.vnodes)):
-                if (i,j) in vnet.vtopo.edges():
-                    sub_matrix[i][j] = '1'
-                    sub_matrix[j][i] = '1'
-                elif i == j:
-                    sub_matrix[i][j] = '.'
-                elif sub_matrix[i][j] == '':
-                    sub_matrix[i][j] = '0'
-        #print sub_matrix
-        #str_index = gen_index_str(len(vnet.vnodes))
-        #print str_index
-        index =gen_index(len(vnet.vnodes))
-        sub_matrix = np.insert(sub_matrix, 0, index, axis=1)
-        #print sub_matrix
-        sub_matrix = get_str_matrix(sub_matrix)
+        # 1 for connected, 0 for not connected, '.' on the diagonal
+        sub_matrix = np.where(vnet.get_adj_matrix(), '1', '0')
+        np.fill_diagonal(sub_matrix, '.')
+        sub_matrix = np.column_stack((vnodeid, sub_matrix))
         fopen.write('\t'.join(sub_header))
         fopen.write("\n".join(["\t".join(r) for r in sub_matrix]))
         if vn_list.index(vnet) == len(vn_list) - 1:
             fopen.write(';\n')
         else:
             fopen.write('\n')
-    fopen.close()            
+    close_data(fopen, ampl_data_file)
         
+def num2str(value):
+    """
+    format an entry of a numeric cost matrix for the data file, 
+    a missing entry (NaN) is printed as '.'
+    """
+    if np.isnan(value):
+        return '.'
+    return str(float(value))
+
+def num_matrix_str(num_matrix):
+    """
+    convert a numeric cost matrix into rows of strings for the data file,
+    with the row index (starting from 1) in the first column
+    """
+    str_rows = []
+    for index in range(len(num_matrix)):
+        str_row = [str(index + 1)]
+        str_row.extend([num2str(value) for value in num_matrix[index]])
+        str_rows.append(str_row)
+    return str_rows
+
 def gen_index(stop):
     ''' generate a array of sequential number in str type '''
     index = []
@@ -458,7 +540,7 @@ def print_c(model, failed, num_vp, data_file):
     ''' print parameter c '''
     c_header = 'param c :=\n'
     vn_list = model.vnets
-    fopen = open(data_file, 'a')
+    fopen = open_data(data_file)
     fopen.write(c_header)
     #print "num_standby: ", model.num_standby
     for vnet in vn_list:
@@ -506,6 +588,51 @@ def print_c(model, failed, num_vp, data_file):
                 fopen.write("\n".join(["\t".join(r) for r in sub_matrix]))
                 fopen.write('\n')
     fopen.write(';\n')
+    close_data(fopen, data_file)
+
+
+def print_c_sparse(model, failed, data_file):
+    """
+    print parameter c in the sparse (list) form, only the nonzero entries
+    c[j,f,i,k,k] are given, where i is a standby router and k is a neighbor 
+    of the failed router f. The value does not depend on the virtual 
+    interface, and gamma[j,f,i,m,k] is only 1 when m = k, so the other 
+    entries take the default value 0 in dyn.mod. 
+    For example:
+    param c :=
+    1	3	2	4	4	0.00042
+    1	3	2	7	7	0.00031
+    ....
+    ;
+    """
+    c_rows = []
+    for vn_index, vnet in enumerate(model.vnets):
+        if failed[vn_index] == -1:
+            continue
+        fnode = vnet.vnodes[failed[vn_index]]
+        standby = np.array(vnet.get_standby_ids(), dtype=int)
+        neighbors = np.array(fnode.vneighbors, dtype=int)
+        if len(standby) == 0 or len(neighbors) == 0:
+            continue
+        traffic = np.array([fnode.neighbor_traffic[k] for k in neighbors])
+        # one row per (standby, neighbor) pair
+        svr_col = np.repeat(standby, len(neighbors))
+        nbr_col = np.tile(neighbors, len(standby))
+        rows = np.empty((len(svr_col), 6))
+        rows[:, 0] = vnet.vnet_id
+        rows[:, 1] = failed[vn_index] + 1
+        rows[:, 2] = svr_col + 1
+        rows[:, 3] = nbr_col + 1
+        rows[:, 4] = nbr_col + 1
+        rows[:, 5] = np.tile(traffic, len(standby))
+        c_rows.append(rows[svr_col != nbr_col])
+    fopen = open_data(data_file)
+    fopen.write('param c :=\n')
+    if c_rows:
+        np.savetxt(fopen, np.vstack(c_rows), 
+                   fmt='%d\t%d\t%d\t%d\t%d\t%.10g')
+    fopen.write(';\n')
+    close_data(fopen, data_file)
   
 
     
@@ -556,7 +683,7 @@ def norm_data2(data_matrix):
     
 def viface_opera_para(data_file):
     ''' print parameters for cost function'''
-    fopen = open(data_file, 'a')
+    fopen = open_data(data_file)
     vifop_para = """
     #### Cost Function Parameters ####
     # virtual interface operation parameters
@@ -566,7 +693,7 @@ def viface_opera_para(data_file):
     """.format(0.2,0.2,2)
     vifop_para = textwrap.dedent(vifop_para)
     fopen.write(vifop_para)
-    fopen.close()    
+    close_data(fopen, data_file)
 
 
 def set_rtt(model):
@@ -592,48 +719,72 @@ def set_rtt(model):
     rtt_matrix = np.insert(norm_rtt, 0, str_index, axis=1)
     return rtt_matrix
 
-def set_rtt2(model,dist_matrix):
+def set_rtt2(model, dist_matrix):
     """
     set round trip time between any pair of two nodes in the substrate network
-    the RTT is proportial to the hop counts
+    the RTT is proportial to the hop counts: each hop on the shortest (hop 
+    count) path adds its distance scaled by a random factor in [0.5, 1).
+    All the paths come from one all-pairs BFS (predecessor matrix), and the 
+    hops of all pairs are scaled in one pass. The factors are drawn from the 
+    global random stream in pair (i, j > i) then hop order, one per hop, so 
+    the draws that follow are the same for a given seed.
     """
     
     snodes = model.snet_nodes
-    str_index = gen_index_str(len(snodes))
-    rtt_matrix = scipy.zeros((len(snodes), len(snodes)), dtype = object)
+    num_nodes = len(snodes)
+    rtt_matrix = np.empty((num_nodes, num_nodes))
+    rtt_matrix.fill(np.nan)
     #dist_matrix = model.cost_dict['dist']
     
-    for i in range(len(snodes)):
-        for j in range(len(snodes)):
-            if i == j:
-                rtt_matrix[i][j] = '.'
-            elif j > i:
-                path = nx.shortest_path(model.snet_topo, i,j)
-                tmp_rtt = 0
-                for k in range(len(path)-1):
-                    src = path[k]
-                    dst = path[k+1]
-                    tempdist = eval(dist_matrix[src][dst+1])
-                    tmp_rtt += round(tempdist * random.uniform(0.5,1), 4)
-                rtt_matrix[i][j] = str(tmp_rtt)
-                rtt_matrix[j][i] = str(tmp_rtt)
-            else:
-                pass
+    adj = nx.to_scipy_sparse_matrix(model.snet_topo, nodelist=range(num_nodes))
+    hop_count, pred = scipy.sparse.csgraph.shortest_path(adj, directed=False,
+                                                         unweighted=True,
+                                                         return_predecessors=True)
+    # node pairs (i, j), j > i, each path is walked back from j to i
+    pair_src, pair_dst = np.triu_indices(num_nodes, 1)
+    reachable = np.isfinite(hop_count[pair_src, pair_dst])
+    pair_src, pair_dst = pair_src[reachable], pair_dst[reachable]
+    pair_hops = hop_count[pair_src, pair_dst].astype(int)
+    pair, src, cur = np.arange(len(pair_src)), pair_src, pair_dst
+    # position of the hop on its path, counted from i
+    hop_pos = pair_hops - 1
+    hop_pair = []
+    hop_order = []
+    hop_dist = []
+    while len(pair) > 0:
+        prev = pred[src, cur]
+        hop_pair.append(pair)
+        hop_order.append(hop_pos)
+        hop_dist.append(dist_matrix[prev, cur])
+        active = prev != src
+        pair, src, cur = pair[active], src[active], prev[active]
+        hop_pos = hop_pos[active] - 1
+    hop_pair = np.concatenate(hop_pair)
+    hop_order = np.concatenate(hop_order)
+    hop_dist = np.concatenate(hop_dist)
+    
+    factor = np.empty(len(hop_dist))
+    factor[np.lexsort((hop_order, hop_pair))] = [random.uniform(0.5, 1) 
+                                                 for k in xrange(len(hop_dist))]
+    hop_rtt = np.round(hop_dist * factor, 4)
+    # sum of 4-decimal values, as printed in the data file
+    pair_rtt = np.round(np.bincount(hop_pair, weights=hop_rtt,
+                                    minlength=len(pair_src)), 4)
+    rtt_matrix[pair_src, pair_dst] = pair_rtt
+    rtt_matrix[pair_dst, pair_src] = pair_rtt
     #norm_rtt = norm_data2(rtt_matrix)
-    rtt_matrix = np.insert(rtt_matrix, 0, str_index, axis=1) 
     #print rtt_matrix  
     return rtt_matrix        
 
-
 def print_rtt(model, data_file, dist_matrix):
     """
     print rtt information in ampl data file
     """
-    rtt_matrix = set_rtt2(model,dist_matrix)
+    rtt_matrix = set_rtt2(model, dist_matrix)
     #print rtt_matrix
     nodeids = map(str, range(1, len(model.snet_nodes)+1))
     header_for_print = '\t'.join(nodeids)
-    rtt_matrix_print = "\n".join(["\t".join(r) for r in rtt_matrix])
+    rtt_matrix_print = "\n".join(["\t".join(r) for r in num_matrix_str(rtt_matrix)])
     #print header_for_print, rtt_matrix_print
     rtt_para = """
     # round trip time between two direct virtual links (ms)
@@ -641,47 +792,27 @@ def print_rtt(model, data_file, dist_matrix):
     {1}
     ;
     """.format(header_for_print, rtt_matrix_print)
-    fopen = open(data_file, 'a')      
+    fopen = open_data(data_file)
     fopen.write(rtt_para)
-    fopen.close()
+    close_data(fopen, data_file)
     return rtt_matrix
 
 
 def geo_dist(model, geo_info):
-    ''' get geo-distance matrix with column index '''
-    snodes = model.snet_topo.nodes()
-    str_index = gen_index_str(len(snodes))
-    dist_matrix = scipy.zeros((len(snodes), len(snodes)), 
-                                     dtype = object)
-    for i in range(len(snodes)):
-        for j in range(len(snodes)):
-            if i == j:
-                dist_matrix[i][j] = '.'
-            else:
-                lat1, lon1 = geo_info[i]
-                lat2, lon2 = geo_info[j]
-                dist = round(topo_type.geocalc(lat1, lon1, lat2, lon2)/1000, 4)
-                #print "dist", dist
-                dist_matrix[i][j] = str(dist)
-    #norm_dist = norm_data2(dist_matrix)
-    if model.snet_type != 'random':
-        dist_matrix = np.insert(dist_matrix, 0, str_index, axis=1)
-    #print dist_matrix
-    return dist_matrix
+    ''' get geo-distance matrix (kkm), the diagonal is NaN '''
+    return topo_dist.geo_dist_matrix(geo_info)
     
     
 def print_geo_dist(model, data_file):
     ''' print geo distance'''
     if model.snet_type != 'random':
+        # cached per topology file, see topo_dist
         xml_file = TOPO_PATH + model.snet_type + ".xml"
-        node_dict, link_dict, node_dict_new = topo_xml.run(xml_file)
-        geo_info = node_dict_new
-        
-    dist_matrix = geo_dist(model, geo_info)
+        dist_matrix = topo_dist.get_dist_matrix(xml_file)
     #print dist_matrix
     nodeids = map(str, range(1, len(model.snet_nodes)+1))
     header_for_print = '\t'.join(nodeids)
-    dist_matrix_print = "\n".join(["\t".join(r) for r in dist_matrix])
+    dist_matrix_print = "\n".join(["\t".join(r) for r in num_matrix_str(dist_matrix)])
     #print header_for_print, dist_matrix_print
     geo_para = """
     # geographcal distance (kkm)
@@ -689,9 +820,9 @@ def print_geo_dist(model, data_file):
     {1}
     ;
     """.format(header_for_print, dist_matrix_print)
-    fopen = open(data_file, 'a')      
+    fopen = open_data(data_file)
     fopen.write(geo_para)
-    fopen.close()
+    close_data(fopen, data_file)
     return dist_matrix
     
 def print_weight1(w_a,w_b, data_file):
@@ -707,10 +838,10 @@ def print_weight1(w_a,w_b, data_file):
     param b2 := {3} ;
     param b3 := {4} ;    
     """.format(w_a[0], w_a[1], w_b[0], w_b[1], 0)
-    fopen = open(data_file, 'a')      
+    fopen = open_data(data_file)
     weight_para = textwrap.dedent(weight_para)
     fopen.write(weight_para)
-    fopen.close()
+    close_data(fopen, data_file)
   
 def print_res_info(snet_info, data_file):
     """
@@ -722,20 +853,20 @@ def print_res_info(snet_info, data_file):
     for node_id in snet_info:
         cpu = snet_info[node_id]['cpu']
         #ram = snet_info[node_id]['ram']
-        cpu_res.append(str(1-cpu))
-        #ram_res.append(str(1-ram))
+        cpu_res.append(1-cpu)
+        #ram_res.append(1-ram)
     str_index = gen_index_str(len(snet_info.keys()))
     index_with_tap = '\t'.join(str_index)   
     res_info = """
     # the available resources on physical router i
     param res (tr):\t{}\t:=
     cpu \t{};
-    """.format(index_with_tap,'\t'.join(cpu_res))
-    fopen = open(data_file, 'a')      
+    """.format(index_with_tap,'\t'.join([str(cpu) for cpu in cpu_res]))
+    fopen = open_data(data_file)
     res_info = textwrap.dedent(res_info)
     fopen.write(res_info)
-    fopen.close()
-    res_matrix = [cpu_res]
+    close_data(fopen, data_file)
+    res_matrix = np.array([cpu_res])
     return res_matrix
   
 
@@ -751,9 +882,9 @@ def print_res_weight(w_h, data_file):
     param h:= cpu {};
     """.format(w_h[0])
     to_print = textwrap.dedent(to_print)
-    fopen = open(data_file, 'a')
+    fopen = open_data(data_file)
     fopen.write(to_print)
-    fopen.close()
+    close_data(fopen, data_file)
     
 def print_obj_weight(w_m, data_file):
     """
@@ -770,9 +901,9 @@ def print_obj_weight(w_m, data_file):
     param m3 := {} ;
     """.format(w_m[0], w_m[1], w_m[2])
     to_print = textwrap.dedent(to_print)
-    fopen = open(data_file, 'a')
+    fopen = open_data(data_file)
     fopen.write(to_print)
-    fopen.close()    
+    close_data(fopen, data_file)
     
     
     
@@ -801,30 +932,22 @@ def print_tau(model, ampl_data_file):
     param tau (tr) : {}  :=
     {}\t;
     """.format(node_index_str, matrix_str)
-    fopen = open(ampl_data_file, 'a')
+    fopen = open_data(ampl_data_file)
     fopen.write(to_print)
-    fopen.close()
+    close_data(fopen, ampl_data_file)
 
 def matrix_str2num(cost_dict):
     """
-    convert cost matrix from string to numeric matrix. If it is a '.', 
-    then change it to 0
+    convert the numeric cost matrices into the .mat layout: a missing 
+    entry (NaN) is 0, and the dist and rtt matrices have the node index 
+    (starting from 1) in the first column
     """        
     mat_dict = {}
     for item in cost_dict:
-        #print item
-        rows = len(cost_dict[item])
-        cols = len(cost_dict[item][0])
-        mat_dict[item] = []
-        for row_i in range(rows):
-            tmp = []
-            for col_j in range(cols):
-                #print item, row_i, col_j
-                if cost_dict[item][row_i][col_j] == '.':
-                    tmp.append(0)
-                else:
-                    tmp.append(float(cost_dict[item][row_i][col_j]))
-            mat_dict[item].append(tmp)
+        mat_dict[item] = np.nan_to_num(cost_dict[item])
+        if item in ('dist', 'rtt'):
+            index = np.arange(1, len(mat_dict[item]) + 1)
+            mat_dict[item] = np.insert(mat_dict[item], 0, index, axis=1)
     return mat_dict
 
     
@@ -902,25 +1025,29 @@ def dryrun(model, ampl_data_file):
 
 
 def run(model, snet_info, data_file, mat_file):
-    ''' program wrapper '''
+    """
+    program wrapper
+    """
   
     #failed = set_info(model, ampl_data_file)
-    print_header(data_file)
-    print_index_bound(model, data_file)
+    data_out = data_writer(data_file, 'w')
+    print_header(data_out)
+    print_index_bound(model, data_out)
     #failed = set_info(model, data_file)  
-    print_num_ports(model, data_file)
-    print_vnode_viface(model, data_file)
-    bw_matrix = print_bw(model, data_file)
-    print_indicator(model, data_file)
+    print_num_ports(model, data_out)
+    print_vnode_viface(model, data_out)
+    bw_matrix = print_bw(model, data_out)
+    print_indicator(model, data_out)
     #print_delta(model, data_file)
     #print_limit(model, data_file, standby_limit)
-    print_e(model, data_file)
+    print_e(model, data_out)
     #para_c(model, failed, num_vp, data_file)
-    viface_opera_para(data_file)
-    print_tau(model, data_file)
-    dist_matrix = print_geo_dist(model, data_file)
-    rtt_matrix = print_rtt(model, data_file,dist_matrix)   
-    res_matrix = print_res_info(snet_info, data_file)
+    viface_opera_para(data_out)
+    print_tau(model, data_out)
+    dist_matrix = print_geo_dist(model, data_out)
+    rtt_matrix = print_rtt(model, data_out, dist_matrix)   
+    res_matrix = print_res_info(snet_info, data_out)
+    data_out.close()
     # create cost mat file for data process
     cost_dict = {}
     cost_dict['bw'] = bw_matrix
@@ -941,17 +1068,22 @@ def change_limits(model, data_file, standby_limit):
     print_limit(model, data_file, standby_limit)
     
 
-def adjust_run(model_adjust, snet_info, num_vp, data_file):
+def adjust_run(model_adjust, snet_info, num_vp, data_file, sparse_c=False):
     """
     Print changed information:
     Set of failure
     param beta, gamma, c
+    If sparse_c is True, param c is printed in the list form with only the
+    nonzero entries (see print_c_sparse)
     """
     failed = set_info(model_adjust, data_file)
     print_beta(model_adjust, data_file)
     #para_gamma(model_adjust, failed, num_vp, data_file)
-    num_viface = len(model_adjust.snet_nodes)
-    print_c(model_adjust, failed, num_viface, data_file)
+    if sparse_c:
+        print_c_sparse(model_adjust, failed, data_file)
+    else:
+        num_viface = len(model_adjust.snet_nodes)
+        print_c(model_adjust, failed, num_viface, data_file)
     return failed
     
 
@@ -998,7 +1130,7 @@ def find_link_capacity(snet_info, src_snode, dst_snode):
 def get_slink_info(model_f):
     ''' collect the substrate link information from the model '''
     slinks = model_f.snet_topo.edges()
-    snet_info = model_f.get_snet_info()
+    snet_state = model_f.snet_state
     slinks.sort()
     slink_dict = {}
     slink_id = 1
@@ -1006,7 +1138,7 @@ def get_slink_info(model_f):
         slink_dict[slink_id] = {}
         slink_dict[slink_id]['src'] = slink[0] + 1
         slink_dict[slink_id]['dst'] = slink[1] + 1
-        slink_dict[slink_id]['capacity'] = find_link_capacity(snet_info, slink[0], slink[1])
+        slink_dict[slink_id]['capacity'] = snet_state.link_capacity(slink[0], slink[1])
         slink_id += 1
     return slink_dict
         
@@ -1042,22 +1174,37 @@ def print_slink_info(model_f, ampl_data_file):
     {1} \t;
     """.format(num_slinks, matrix_str)
     
-    fopen = open(ampl_data_file, 'a')
+    fopen = open_data(ampl_data_file)
     fopen.write(slink_param)
-    fopen.close()
+    close_data(fopen, ampl_data_file)
     return slink_dict
     
     
     
+class demand_table(dict):
+    """
+    The capacity demands {demand_id: demand}, with the index
+    {(vn_id, fnode_id, svr, nbr_id): demand_id} to look up a demand
+    """
+    def __init__(self):
+        dict.__init__(self)
+        self.index = {}
+        
+    def find(self, vn_id, fnode_id, svr, nbr_id):
+        ''' find the demand id, None if there is no such demand '''
+        return self.index.get((vn_id, fnode_id, svr, nbr_id))
+        
+        
 def get_demand_info(model_f):
     """
     Get the bw capacity demand between the S-VR and the faile VR's neighbors
+    as a demand_table
     """
     fail_dict = model_f.failed_dict
     failed = fail_dict.values()
     vnet_info = model_f.get_vnet_info()
     vn_list = model_f.vnets
-    demand_c_dict = {}
+    demand_c_dict = demand_table()
     demand_id = 1
     for vnet in vn_list:
         vnet_id = vnet.vnet_id
@@ -1080,14 +1227,18 @@ def get_demand_info(model_f):
                         vnet_info = model_f.get_vnet_info()
                         print vnet_info[vnet_id]
                         raise ValueError("capacity should be positive")
+                    demand_key = (vnet_id, fail_dict[vnet_id] + 1, svr + 1, 
+                                  fnode_nbr + 1)
+                    demand_c_dict.index[demand_key] = demand_id
                     demand_id += 1
     return demand_c_dict
                 
 
-def print_demand_c_info(model_f, ampl_data_file):
+def print_demand_c_info(demand_dict, demand_path, ampl_data_file):
     """
     Print capacity demand to the substrate link information in the 
-    ample data file, in the form of:
+    ample data file, Pd is the number of paths of the demand in demand_path, 
+    in the form of:
     For example:
     param: demand_vn  	demand_fnode 	demand_src 	demand_dst demand_c    Pd:=
     1 		1 			2 			1 		4     0.21        3
@@ -1097,20 +1248,21 @@ def print_demand_c_info(model_f, ampl_data_file):
     ........
     ;
     """
-    demand_dict = get_demand_info(model_f)
     num_demand = len(demand_dict.keys())
     matrix_str = '\t\t\t'.join([str(1), str(demand_dict[1]['vn_id']), 
                                str(demand_dict[1]['fnode_id']),
                                str(demand_dict[1]['svr']),
                                str(demand_dict[1]['nbr_id']),
-                               str(demand_dict[1]['capacity']), str(3)]) + '\n'
+                               str(demand_dict[1]['capacity']), 
+                               str(len(demand_path[1]))]) + '\n'
                                
     for index in range(2, num_demand + 1):
         temp_str = '\t' + '\t\t\t'.join([str(index), str(demand_dict[index]['vn_id']), 
                                str(demand_dict[index]['fnode_id']),
                                str(demand_dict[index]['svr']),
                                str(demand_dict[index]['nbr_id']),
-                               str(demand_dict[index]['capacity']), str(3)]) + '\n'
+                               str(demand_dict[index]['capacity']), 
+                               str(len(demand_path[index]))]) + '\n'
         matrix_str += temp_str
     
     demand_param = """
@@ -1120,10 +1272,9 @@ def print_demand_c_info(model_f, ampl_data_file):
     {1} \t;
     """.format(num_demand, matrix_str)
     
-    fopen = open(ampl_data_file, 'a')
+    fopen = open_data(ampl_data_file)
     fopen.write(demand_param)
-    fopen.close()
-    return demand_dict
+    close_data(fopen, ampl_data_file)
     
     
 def find_slink_id(slink_dict, src, dst):
@@ -1138,45 +1289,108 @@ def find_slink_id(slink_dict, src, dst):
         if slink_dict[slink_id]['src'] == src and slink_dict[slink_id]['dst'] == dst:
             return slink_id    
     
-def paths_per_demand(paths_read, svr, nbr, slink_dict):
+def get_slink_index(slink_dict):
+    """
+    Build the (src, dst) -> substrate link id table of slink_dict, 
+    src < dst, node ids start from 1 
+    """
+    slink_index = {}
+    for slink_id in slink_dict:
+        node_pair = (slink_dict[slink_id]['src'], slink_dict[slink_id]['dst'])
+        slink_index[node_pair] = slink_id
+    return slink_index
+    
+def read_path_index(path_file, slink_index):
     """
-    get the paths for a particular capacity demand between two substrate nodes
-    paths_read is the array of lines read from a path file
+    Parse a path file into a path index:
+    {(src, dst): {path_id: [link ids]}}, src < dst 
+    each line of the path file is in the form of 
+    p x <path_id>: <src> <dst> x <node_1>_<node_2>_..._<node_n>
+    the first two lines are headers
     """
-    path_dict = {}
-    for line in paths_read:
+    fopen = open(path_file, 'r')
+    lines = fopen.readlines()[2:]
+    fopen.close()
+    path_index = {}
+    for line in lines:
         p_strs = line.strip().split()
-        d_pair = int(p_strs[3]), int(p_strs[4])
-        if d_pair == (svr, nbr) or d_pair == (nbr, svr):
-            path_id = int(p_strs[2].rstrip(':'))
-            path_dict[path_id] = []
-            path_track = p_strs[6].split('_')
-            for index in range(0, len(path_track)-1):
-                node_pair = (int(path_track[index]), int(path_track[index + 1]))
-                src = min(node_pair)
-                dst = max(node_pair)
-                link_id = find_slink_id(slink_dict, src, dst)
-                path_dict[path_id].append(link_id)
-                #print "check", path_dict[path_id]
-    if len(path_dict) == 1:
-        path_dict[2] = path_dict[1]
-        path_dict[3] = path_dict[1]
+        node_a, node_b = int(p_strs[3]), int(p_strs[4])
+        d_pair = (min(node_a, node_b), max(node_a, node_b))
+        path_id = int(p_strs[2].rstrip(':'))
+        path_track = [int(node) for node in p_strs[6].split('_')]
+        links = []
+        for index in range(0, len(path_track)-1):
+            node_pair = (path_track[index], path_track[index + 1])
+            src = min(node_pair)
+            dst = max(node_pair)
+            links.append(slink_index.get((src, dst)))
+        path_index.setdefault(d_pair, {})[path_id] = links
+    return path_index
+    
+# path indexes parsed so far, {(path_file, slink key): path_index}
+path_index_cache = {}
+
+def get_path_index(path_file, slink_dict):
+    """
+    Get the path index of a path file (see read_path_index), the file is 
+    parsed only once per topology (the same substrate links)
+    """
+    slink_index = get_slink_index(slink_dict)
+    slink_key = tuple(sorted(slink_index.items()))
+    cache_key = (path_file, slink_key)
+    if cache_key not in path_index_cache:
+        path_index_cache[cache_key] = read_path_index(path_file, slink_index)
+    return path_index_cache[cache_key]
+    
+def get_ksp_index(model_f, slink_dict, k=topo_path.K_PATHS):
+    """
+    Get the path index (see read_path_index) of the k-shortest paths of 
+    the substrate topology, generated by topo_path
+    """
+    slink_index = get_slink_index(slink_dict)
+    slink_key = tuple(sorted(slink_index.items()))
+    cache_key = (k, slink_key)
+    if cache_key not in path_index_cache:
+        path_catalog = topo_path.get_path_catalog(model_f.snet_topo, 
+                                                  model_f.snet_type, k)
+        path_index = {}
+        for d_pair in path_catalog:
+            path_index[d_pair] = {}
+            for index, path_track in enumerate(path_catalog[d_pair]):
+                links = []
+                for hop in range(0, len(path_track)-1):
+                    node_pair = (path_track[hop], path_track[hop + 1])
+                    links.append(slink_index.get((min(node_pair), max(node_pair))))
+                path_index[d_pair][index + 1] = links
+        path_index_cache[cache_key] = path_index
+    return path_index_cache[cache_key]
+    
+def paths_per_demand(path_index, svr, nbr):
+    """
+    get the paths for a particular capacity demand between two substrate 
+    nodes from the path index, as {path_id: [link ids]}
+    """
+    d_pair = (min(svr, nbr), max(svr, nbr))
+    path_dict = dict(path_index.get(d_pair, {}))
     #print "check 3", path_dict
     return path_dict
              
 
-def get_path_info(path_file, demand_dict, slink_dict):
+def get_path_info(model_f, demand_dict, slink_dict, path_file=None):
     """
-    Get path information from csv file
+    Get path information of each demand, from the k-shortest paths of the
+    substrate topology, or from a path file if path_file is given
     """
-    fopen = open(path_file, 'r')
-    lines = fopen.readlines()[2:]
+    if path_file is None:
+        path_index = get_ksp_index(model_f, slink_dict)
+    else:
+        path_index = get_path_index(path_file, slink_dict)
     demand_path = {}
     for demand_id in demand_dict:
         svr = demand_dict[demand_id]['svr']
         nbr = demand_dict[demand_id]['nbr_id']
         #print svr, nbr
-        path_dict = paths_per_demand(lines, svr, nbr, slink_dict)
+        path_dict = paths_per_demand(path_index, svr, nbr)
         #print path_dict
         demand_path[demand_id] = path_dict
     return demand_path
@@ -1208,19 +1422,22 @@ def print_path(demand_path, ampl_data_file):
     {0}
     """.format(matrix_str)
     
-    fopen = open(ampl_data_file, 'a')
+    fopen = open_data(ampl_data_file)
     fopen.write(path_param)
-    fopen.close()
+    close_data(fopen, ampl_data_file)
     
-def print_link_path_param(model_f, ampl_data_file):
+def print_link_path_param(model_f, ampl_data_file, path_file=None):
     """
     Print link, demand, and path parameters in the ampl data file
+    ampl_data_file is either the file name or the data_writer shared by 
+    the other sections of the scenario
+    path_file: an external path file (e.g. topo_info/path/<snet>-3path.txt) 
+    to read the paths from, instead of the generated k-shortest paths
     """
-    path_file = 'topo_info/path/%s-3path.txt' % model_f.snet_type
-    
     slink_dict = print_slink_info(model_f, ampl_data_file)
-    demand_dict = print_demand_c_info(model_f, ampl_data_file)
-    demand_path = get_path_info(path_file, demand_dict, slink_dict)
+    demand_dict = get_demand_info(model_f)
+    demand_path = get_path_info(model_f, demand_dict, slink_dict, path_file)
+    print_demand_c_info(demand_dict, demand_path, ampl_data_file)
     print_path(demand_path, ampl_data_file)
     return demand_path, slink_dict, demand_dict
     
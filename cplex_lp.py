@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+This module is to write the cplex lp file of the dyn.mod formulation
+directly from a failure scenario of the model created by create_model.py
+
+It replaces the three steps in lp_gen.sh: ampl expand of dyn.mod with the
+scenario data file, writing the expanded equations and converting them
+into an lp file with convert_ampl.py. The variables and constraints follow
+the same naming as the converted lp file (e.g. u_1_4_2, v_1_4_2_3_3, x_5_1,
+RR, IsStandby_1_4_2), which is used by cplex_run.sh and combine_result.awk
+
+Only the non-trivial parts of the formulation are written, the same as the
+ampl expand output: the virtual interface index m equals k (gamma), and
+only standby routers (delta = 1) and the neighbors of the failed router
+(e = 1) are considered.
+"""
+
+from __future__ import division
+import numpy as np
+
+# virtual interface operation parameters, see ampl_gen.viface_opera_para
+ENABLE = 0.2
+DISABLE = 0.2
+IPCONFIG = 2
+# the upper bound of the resource utilization RR (upRRbd)
+RR_BOUND = 0.8
+# number of terms per line, an lp file line is at most 510 characters
+TERMS_PER_LINE = 8
+
+
+def var_name(name, *index):
+    ''' variable/constraint name in the converted lp format, u[1,4,2] -> u_1_4_2 '''
+    return '_'.join([name] + [str(item) for item in index])
+
+def format_coef(value):
+    ''' format a coefficient or a constant '''
+    return '%.12g' % value
+
+def format_expr(terms):
+    """
+    Format a linear expression given as a list of (coefficient, variable),
+    long expressions are continued on the next lines
+    """
+    expr = []
+    for index, (coef, var) in enumerate(terms):
+        if coef < 0:
+            sign = '-'
+        else:
+            sign = '+'
+        if abs(coef) == 1:
+            term = ' '.join([sign, var])
+        else:
+            term = ' '.join([sign, format_coef(abs(coef)), var])
+        if index > 0 and index % TERMS_PER_LINE == 0:
+            expr.append('\n   ')
+        expr.append(term)
+    expr_str = ' '.join(expr)
+    if expr_str.startswith('+ '):
+        expr_str = expr_str[2:]
+    return expr_str
+
+def write_row(fopen, name, terms, sense, rhs):
+    ''' write a constraint into the lp file '''
+    fopen.write(' ' + name + ': ' + format_expr(terms) + ' ' + sense +
+                ' ' + format_coef(rhs) + '\n')
+
+
+def get_scenario(model_f):
+    """
+    Collect the failed virtual networks of the scenario, as a list of
+    dictionaries with 1-based ids (as in the ampl data file):
+    vn_id: j, fnode_id: f,
+    standby: [i], the standby routers (delta[i,j] = 1, beta[i,j] = 0),
+    nbr: [(k, c[j,f,i,k,k])], the neighbors of the failed router (e[j,f,k] = 1)
+    """
+    failed_dict = model_f.failed_dict
+    scenario = []
+    for vnet in model_f.vnets:
+        failed_vr = failed_dict.get(vnet.vnet_id, -1)
+        if failed_vr == -1:
+            continue
+        fnode = vnet.vnodes[failed_vr]
+        standby = []
+        for node in vnet.vnodes:
+            if node.status == 2:
+                standby.append(node.vnode_id + 1)
+        nbr = []
+        for k in sorted(fnode.vneighbors):
+            nbr.append((k + 1, fnode.neighbor_traffic[k]))
+        scenario.append({'vn_id': vnet.vnet_id,
+                         'fnode_id': failed_vr + 1,
+                         'standby': standby,
+                         'nbr': nbr})
+    return scenario
+
+def get_port_bw(model_f):
+    """
+    Get the number of ports num_p[i] and the sum of the available bw
+    sum{p} b[i,p] for each substrate node, the bw is taken from the cost
+    matrix printed in the ampl data file (row: port, column: node, NaN for
+    no such port)
+    """
+    bw_matrix = model_f.cost_dict['bw']
+    num_port = {}
+    sum_bw = {}
+    for node in model_f.snet_nodes:
+        node_id = node.node_id
+        num_port[node_id + 1] = node.num_iface
+        sum_bw[node_id + 1] = np.nansum(bw_matrix[:node.num_iface, node_id])
+    return num_port, sum_bw
+
+def get_limit(model_f, limit):
+    ''' the standby limit h_i, see ampl_gen.print_limit '''
+    if limit == 'inf':
+        return len(model_f.vnets)
+    return int(limit)
+
+
+def write_objective(fopen, model_f, scenario, w_a, w_b, theta):
+    """
+    Total_Cost:
+    sum (m1 * eta + m2 * sigma) * v[j,f,i,k,k] + m3 * RR
+    """
+    dist_matrix = model_f.cost_dict['dist']
+    rtt_matrix = model_f.cost_dict['rtt']
+    a1, a2 = w_a[0], w_a[1]
+    b1, b2 = w_b[0], w_b[1]
+    m1, m2, m3 = theta
+    # tau = 0, no ip reconfiguration
+    eta = 2 * (DISABLE + ENABLE)
+    terms = []
+    for vn in scenario:
+        j = vn['vn_id']
+        f = vn['fnode_id']
+        for i in vn['standby']:
+            for k, _ in vn['nbr']:
+                if k == i:
+                    continue
+                sigma = b1 * (a1 * dist_matrix[i - 1, f - 1] +
+                              a2 * dist_matrix[i - 1, k - 1]) + \
+                        b2 * rtt_matrix[i - 1, k - 1]
+                coef = m1 * eta + m2 * sigma
+                if coef != 0:
+                    terms.append((coef, var_name('v', j, f, i, k, k)))
+    if m3 != 0:
+        terms.append((m3, 'RR'))
+    fopen.write('minimize\n')
+    fopen.write(' Total_Cost: ' + format_expr(terms) + '\n')
+
+
+def write_constraints(fopen, model_f, scenario, limit, slink_dict,
+                      demand_dict, demand_path):
+    ''' write constraints IsStandby through cl, and upRRbd '''
+    num_port, sum_bw = get_port_bw(model_f)
+    h_limit = get_limit(model_f, limit)
+    fopen.write('subject to\n')
+    # Constraint (1)
+    for vn in scenario:
+        j, f = vn['vn_id'], vn['fnode_id']
+        for i in vn['standby']:
+            write_row(fopen, var_name('IsStandby', j, f, i),
+                      [(1, var_name('u', j, f, i))], '<=', 1)
+    # Constraint (2)
+    for vn in scenario:
+        j, f = vn['vn_id'], vn['fnode_id']
+        for i in vn['standby']:
+            for k, _ in vn['nbr']:
+                if k != i:
+                    write_row(fopen, var_name('IsSelect', j, f, i, k, k),
+                              [(1, var_name('v', j, f, i, k, k)),
+                               (-1, var_name('u', j, f, i))], '<=', 0)
+    # Constraint (3)
+    for vn in scenario:
+        j, f = vn['vn_id'], vn['fnode_id']
+        terms = [(1, var_name('u', j, f, i)) for i in vn['standby']]
+        write_row(fopen, var_name('OneSPerF', j, f), terms, '=', 1)
+    # Constraint (4), one failure per virtual network
+    for vn in scenario:
+        j, f = vn['vn_id'], vn['fnode_id']
+        for i in vn['standby']:
+            write_row(fopen, var_name('OneFPerS', i, j),
+                      [(1, var_name('u', j, f, i))], '<=', 1)
+    # Constraint (5)
+    host_select = {}
+    for vn in scenario:
+        j, f = vn['vn_id'], vn['fnode_id']
+        for i in vn['standby']:
+            host_select.setdefault(i, []).append((1, var_name('u', j, f, i)))
+    for i in sorted(host_select):
+        write_row(fopen, var_name('max_select', i), host_select[i],
+                  '<=', h_limit)
+    # Constraint (6)
+    for vn in scenario:
+        j, f = vn['vn_id'], vn['fnode_id']
+        for i in vn['standby']:
+            terms = [(1, var_name('v', j, f, i, k, k))
+                     for k, _ in vn['nbr'] if k != i]
+            terms.append((-len(terms), var_name('u', j, f, i)))
+            write_row(fopen, var_name('IsConnect', j, f, i), terms, '=', 0)
+    # Constraint (7)
+    for vn in scenario:
+        j, f = vn['vn_id'], vn['fnode_id']
+        for i in vn['standby']:
+            terms = [(c, var_name('v', j, f, i, k, k))
+                     for k, c in vn['nbr'] if k != i and c != 0]
+            terms.append((-sum_bw[i], var_name('u', j, f, i)))
+            write_row(fopen, var_name('bw', i, j, f), terms, '<=', 0)
+    # Constraint (8)
+    host_traffic = {}
+    for vn in scenario:
+        j, f = vn['vn_id'], vn['fnode_id']
+        req_bw = sum([c for k, c in vn['nbr']])
+        for i in vn['standby']:
+            if req_bw != 0:
+                host_traffic.setdefault(i, []).append(
+                    (req_bw, var_name('u', j, f, i)))
+            else:
+                host_traffic.setdefault(i, [])
+    for i in sorted(host_traffic):
+        terms = host_traffic[i] + [(-num_port[i], 'RR')]
+        write_row(fopen, var_name('res_util', i), terms, '<=',
+                  -(num_port[i] - sum_bw[i]))
+    # Constraint (9)
+    vn_index = {}
+    for vn in scenario:
+        vn_index[(vn['vn_id'], vn['fnode_id'])] = vn
+    for d in sorted(demand_dict):
+        demand = demand_dict[d]
+        j, f, i = demand['vn_id'], demand['fnode_id'], demand['svr']
+        if (j, f) not in vn_index or i == f:
+            continue
+        terms = [(1, var_name('x', d, q)) for q in sorted(demand_path[d])]
+        terms.append((-demand['capacity'], var_name('u', j, f, i)))
+        write_row(fopen, var_name('d_pair', d, j, f, i), terms, '=', 0)
+    # Constraint (10)
+    link_flow = {}
+    for d in sorted(demand_path):
+        for q in sorted(demand_path[d]):
+            for l in set(demand_path[d][q]):
+                link_flow.setdefault(l, []).append((1, var_name('x', d, q)))
+    for l in sorted(slink_dict):
+        if l in link_flow:
+            write_row(fopen, var_name('cl', l), link_flow[l], '<=',
+                      slink_dict[l]['capacity'])
+    write_row(fopen, 'upRRbd', [(1, 'RR')], '<=', RR_BOUND)
+
+
+def write_binaries(fopen, scenario):
+    ''' declare the binary variables u and v '''
+    bin_vars = []
+    for vn in scenario:
+        j, f = vn['vn_id'], vn['fnode_id']
+        for i in vn['standby']:
+            bin_vars.append(var_name('u', j, f, i))
+            for k, _ in vn['nbr']:
+                if k != i:
+                    bin_vars.append(var_name('v', j, f, i, k, k))
+    fopen.write('binary\n')
+    for index in range(0, len(bin_vars), TERMS_PER_LINE):
+        fopen.write(' ' + ' '.join(bin_vars[index:index + TERMS_PER_LINE]) +
+                    '\n')
+
+
+def write_lp(model_f, lp_file, w_a, w_b, theta, limit, slink_dict,
+             demand_dict, demand_path):
+    """
+    Write the cplex lp file of a failure scenario in one pass.
+    The inputs are the same as the ones printed in the scenario data file:
+    model_f: the model with the failure scenario (failed_dict, cost_dict)
+    w_a, w_b, theta: the weight parameters (a1, a2), (b1, b2), (m1, m2, m3)
+    limit: the standby limit h_i
+    slink_dict, demand_dict, demand_path: the link-path parameters returned
+    by ampl_gen.print_link_path_param
+    """
+    scenario = get_scenario(model_f)
+    fopen = open(lp_file, 'w', 1 << 16)
+    write_objective(fopen, model_f, scenario, w_a, w_b, theta)
+    write_constraints(fopen, model_f, scenario, limit, slink_dict,
+                      demand_dict, demand_path)
+    write_binaries(fopen, scenario)
+    fopen.write('end\n')
+    fopen.close()
+    return lp_file
@@ -19,18 +19,21 @@ between 0 ~ 1.
 """
 from __future__ import division
 import sys
+import os
 import random
+import multiprocessing
 import networkx as nx
 import topo_gen
 #import topo_type
 import substrate
 import virtual_network as vn
 import ampl_gen
-import shutil
 import topo_xml
+import topo_path
 import heuristic_obj
+import cplex_lp
+import highs_milp
 
-from copy import deepcopy
 from optparse import OptionParser
 
 
@@ -50,8 +53,13 @@ class reconf_model(object):
         5. initialize the substrate network type
         6. initialize the cost dictionay
         6. initialize the number of standby virtual router in each vnet
+        7. initialize the array-backed substrate state (bw and cpu usage)
+        8. initialize the cached views of get_vnet_info and get_snet_info
         """
         self.snet_nodes = []
+        self.snet_state = None
+        self.vnet_info = None
+        self.snet_info = None
         self.snet_topo = nx.Graph()
         self.vnets = []
         self.failed_dict = {}
@@ -65,6 +73,21 @@ class reconf_model(object):
         """
         self.cost_dict = cost_info_dict
         
+    def vnet_changed(self):
+        """
+        drop the cached virtual network information (see get_vnet_info), 
+        it is called by the methods that change the vnode status, the 
+        standby routers or the traffic of the virtual networks
+        """
+        self.vnet_info = None
+        
+    def snet_changed(self):
+        """
+        drop the cached substrate network information (see get_snet_info),
+        it is called by the methods that change the bw or cpu usage, or 
+        the geolocation of the substrate nodes
+        """
+        self.snet_info = None
         
     def create_snet(self, snet_type='geant'):
         ''' create substrate network topology '''
@@ -78,6 +101,9 @@ class reconf_model(object):
         of neighbors a substarte node has. 
         This will help to generate the parameter b[i,p] in the ampl data
         file
+        The residual bw of the interfaces and the cpu usage are kept in 
+        self.snet_state (see substrate.snet_state), the Node objects only 
+        hold the node id, neighbors and geolocation
         """
         #snode_id_list = self.snet_topo.nodes()
         # get a list of nodes with a list of their neighbors
@@ -94,10 +120,11 @@ class reconf_model(object):
                 index = index + 1
             new_node = substrate.Node(node_id, 0, num_iface)
             new_node.set_neighbors(neighbor_list)
-            new_node.add_phy_iface()
-            new_node.set_total_avail_bw()
             self.snet_nodes.append(new_node)
         #self.set_snodes_curr_bw()        
+        self.snet_state = substrate.snet_state([[nbr for nbr, port in node.neighbors] 
+                                                for node in self.snet_nodes])
+        self.snet_changed()
         
     def find_shortestpath(self,src=None, dst=None):
         """
@@ -145,6 +172,7 @@ class reconf_model(object):
                 node_dict, link_dict, node_dict_new = topo_xml.run(xml_file)
                 lat, lon = node_dict_new[node.node_id]
             node.set_geoinfo(lat, lon)    
+        self.snet_changed()
             
 
     def set_res_util(self):
@@ -152,7 +180,8 @@ class reconf_model(object):
         set cpu utilization for physical router
         """
         for node in self.snet_nodes:
-            node.set_res_utilize()
+            self.snet_state.set_res_utilize(node.node_id)
+        self.snet_changed()
             
     def add_vnet(self, max_standby, min_standby, req_bw, vn_id, fixed_node):
         """
@@ -163,12 +192,16 @@ class reconf_model(object):
         """
         new_vnet = vn.vnet([],vn_id)
         new_vnet.vtopo = topo_gen.vnet_gen(self.snet_topo, max_standby, fixed_node)
+        cpu = self.snet_state.cpu
+        cpu_usage = self.snet_state.cpu_usage
         for node in self.snet_nodes:
-            new_usage = round(random.uniform(0, 1/node.cpu),4)
-            node.cpu_usage = node.cpu_usage + new_usage
+            new_usage = round(random.uniform(0, 1/cpu[node.node_id]),4)
+            cpu_usage[node.node_id] = cpu_usage[node.node_id] + new_usage
         self.conf_vnet_node(new_vnet, req_bw)
         self.get_vnet_standbys(new_vnet, min_standby)
         self.vnets.append(new_vnet)
+        self.vnet_changed()
+        self.snet_changed()
     
     
     def conf_vnet_node(self, new_vnet, req_bw):
@@ -186,8 +219,7 @@ class reconf_model(object):
            if snode.node_id in new_vnet.vtopo.nodes():
                new_vnode.set_status(1)
                new_vnode.vneighbors = new_vnet.vtopo.adj[snode.node_id].keys()
-               new_vnode.enable_iface(new_vnode.viface_list, 
-                                      len(new_vnode.vneighbors))
+               new_vnode.enable_iface(len(new_vnode.vneighbors))
            else:
                # the vnode in status 0 are not connected, it could be either 
                # non-active vnodes or standby vnodes
@@ -209,6 +241,7 @@ class reconf_model(object):
         for standby in vnetwork.standby_vnodes:
             standby.set_status(2)
             vnetwork.nonactive_vnodes.remove(standby)
+        self.vnet_changed()
         
     def add_standby(self, diff_standby):
         """
@@ -231,6 +264,7 @@ class reconf_model(object):
             #print "new standby list: ", standby_list
             new_svr_dict[vnet.vnet_id] = new_svr_list
         #print "new added: ", new_svr_dict
+        self.vnet_changed()
         return new_svr_dict
         # check vnet status -- for debug
         #for vnet in self.vnets:
@@ -257,6 +291,7 @@ class reconf_model(object):
                 vnet.nonactive_vnodes.remove(new)
                 #print "NOW: Nonactive: ", len(vnet.nonactive_vnodes)
                 vnet.standby_vnodes.append(new)
+        self.vnet_changed()
            
                    
         
@@ -264,14 +299,16 @@ class reconf_model(object):
         """
         Take a snapshot of physical resource utilization at the failure, 
         which the dynamic reconfiguration is based on
-        Assume each VR runs 1 CPU core at maximum, so 1/self.snet_ndoes[nodeid].cpu
+        Assume each VR runs 1 CPU core at maximum, so 1/self.snet_state.cpu[nodeid]
         """
+        cpu = self.snet_state.cpu
         for vnet in self.vnets:
             vnet_info = vnet.get_vnet_info()
             vnode_up = vnet_info['up_nodes']
             for nodeid in vnode_up:
-                self.snet_nodes[nodeid].cpu_usage += \
-                    round(random.uniform(0, 1/self.snet_nodes[nodeid].cpu),5)
+                self.snet_state.cpu_usage[nodeid] += \
+                    round(random.uniform(0, 1/cpu[nodeid]),5)
+        self.snet_changed()
     
     
     def find_all_shortestpaths(self, src=None, dst=None):
@@ -286,53 +323,22 @@ class reconf_model(object):
         
     def alloc_path(self, path_list, link_usage):
         """
-        based on the link usage, allocate a path
+        based on the link usage, allocate a path: the first path in 
+        path_list that has more available bw than the link usage on each
+        port along the path. Return allocated (0/1), the path and its 
+        (node, port) hops, see substrate.snet_state.path_hops
         """
+        snet_state = self.snet_state
         allocated = 0
+        hops = None
         #print path_list
         for path in path_list:
-            find = 1
-            for node_id in path:
-                neighbor_list = self.find_remote_onpath(path, node_id)
-                if path.index(node_id) == 0:
-                    neighbor_id = neighbor_list[0]
-                    iface_id = self.snet_nodes[node_id].find_iface2neighbor(neighbor_id)
-                    res_bw = self.snet_nodes[node_id].iface_list[iface_id].avail_bw - link_usage
-                    #print "check", node_id, self.snet_nodes[node_id].iface_list[iface_id].avail_bw, link_usage
-                    if res_bw <= 0:
-                        find = 0
-                        print "not available"
-                        break
-                elif path.index(node_id) < len(path) - 1:
-                    iface_id1 = self.snet_nodes[node_id].find_iface2neighbor(neighbor_list[0])
-                    res_bw = self.snet_nodes[node_id].iface_list[iface_id1].avail_bw - link_usage
-                    #print "check", node_id, self.snet_nodes[node_id].iface_list[iface_id1].avail_bw, link_usage
-                    if res_bw <= 0:
-                        find = 0
-                        print "not available"
-                        break
-                    iface_id2 = self.snet_nodes[node_id].find_iface2neighbor(neighbor_list[1])
-                    res_bw = self.snet_nodes[node_id].iface_list[iface_id2].avail_bw - link_usage
-                    if res_bw <= 0:
-                        find = 0
-                        print "not available"
-                        break
-                    #print "check", node_id, self.snet_nodes[node_id].iface_list[iface_id1].avail_bw, link_usage
-                else:
-                    iface_id1 = self.snet_nodes[node_id].find_iface2neighbor(neighbor_list[0])
-                    res_bw = self.snet_nodes[node_id].iface_list[iface_id1].avail_bw - link_usage
-                    #print "check", node_id, self.snet_nodes[node_id].iface_list[iface_id1].avail_bw, link_usage
-                    if res_bw <= 0:
-                        find = 0
-                        print "not available"
-                        break
-                    
-            if find == 0:
-                continue
-            else:
+            hops = snet_state.path_hops(path)
+            if snet_state.path_feasible(hops, link_usage):
                 allocated = 1
                 break
-        return allocated, path 
+            print "not available"
+        return allocated, path, hops
               
                 
     def snapshot_bw_util(self, req_bw = 0.01):
@@ -340,7 +346,11 @@ class reconf_model(object):
         Take a snapshot of physical link bandwith usage at the failure,
         Based on the virtual link connections and determin the traffic on 
         the physical links
+        The shortest paths of the virtual links are taken from the 
+        shortest path catalog of the substrate topology (topo_path)
         """              
+        snet_state = self.snet_state
+        path_catalog = topo_path.get_shortest_catalog(self.snet_topo)
         for vnet in self.vnets:
             vnet_info = vnet.get_vnet_info()
             vtopo = vnet_info['topo']
@@ -357,9 +367,10 @@ class reconf_model(object):
                     print "+1"
                     link_usage = round(random.uniform(0,req_bw), 5)
                     
-                path_list = self.find_all_shortestpaths(src, dst)
+                path_list = path_catalog.get_paths(src, dst)
                 #print link_usage
-                allocated, snet_path_nodes = self.alloc_path(path_list, link_usage)
+                allocated, snet_path_nodes, hops = self.alloc_path(path_list, 
+                                                                   link_usage)
                 #print allocated, snet_path_nodes
                 if allocated == 0:
                     raise ValueError("Insufficient bandwidth allocation, exit!")
@@ -367,34 +378,9 @@ class reconf_model(object):
                 else:
                     vnet.set_traffic(src, dst, link_usage)
                     vnet.set_traffic(dst, src, link_usage)
-                    for node_id in snet_path_nodes:
-                        neighbor_list = self.find_remote_onpath(snet_path_nodes, 
-                                                                node_id)
-                        if snet_path_nodes.index(node_id) == 0:
-                            neighbor_id = neighbor_list[0]
-                            iface_id = self.snet_nodes[node_id].find_iface2neighbor(neighbor_id)
-                            #self.snet_nodes[node_id].iface_list[iface_id].set_utilize(link_usage)
-                            self.snet_nodes[node_id].iface_list[iface_id].update_avail_bw(link_usage)
-                            self.snet_nodes[node_id].total_avail_bw -= link_usage
-                            #print self.snet_nodes[node_id].iface_list[iface_id].avail_bw, link_usage
-                        elif snet_path_nodes.index(node_id) < len(snet_path_nodes) - 1:
-                            iface_id1 = self.snet_nodes[node_id].find_iface2neighbor(neighbor_list[0])
-                            #self.snet_nodes[node_id].iface_list[iface_id1].set_utilize(link_usage)
-                            self.snet_nodes[node_id].iface_list[iface_id1].update_avail_bw(link_usage)
-                            self.snet_nodes[node_id].total_avail_bw -= link_usage
-                            #print self.snet_nodes[node_id].iface_list[iface_id1].avail_bw, link_usage
-                            iface_id2 = self.snet_nodes[node_id].find_iface2neighbor(neighbor_list[1])
-                            #self.snet_nodes[node_id].iface_list[iface_id2].set_utilize(link_usage)
-                            self.snet_nodes[node_id].iface_list[iface_id2].update_avail_bw(link_usage)
-                            self.snet_nodes[node_id].total_avail_bw -= link_usage
-                            #print self.snet_nodes[node_id].iface_list[iface_id2].avail_bw, link_usage
-                        else:
-                            iface_id1 = self.snet_nodes[node_id].find_iface2neighbor(neighbor_list[0])
-                            #self.snet_nodes[node_id].iface_list[iface_id1].set_utilize(link_usage)
-                            self.snet_nodes[node_id].iface_list[iface_id1].update_avail_bw(link_usage)
-                            self.snet_nodes[node_id].total_avail_bw -= link_usage
-                            #print self.snet_nodes[node_id].iface_list[iface_id1].avail_bw, link_usage
-                       
+                    snet_state.use_path(hops, link_usage)
+        self.vnet_changed()
+        self.snet_changed()
 
 
     def get_snet_info(self):
@@ -404,22 +390,32 @@ class reconf_model(object):
         node attributes(cpu, ram, num_iface, etc.)
         a sub-library for interface information
         Second level key: iface_id, value: iface attributes (bw, status, etc.)
+        The attributes are read from self.snet_state, prefer reading the 
+        arrays of self.snet_state directly where the dictionary is not needed
+        The dictionary is built once and shared until the substrate changes 
+        (see snet_changed), it must not be modified by the caller
         """
-        snet_info = {}
-        for node in self.snet_nodes:
-            snet_info[node.node_id] = {}
-            snet_info[node.node_id] = node.get_node_info()
-        return snet_info
+        if self.snet_info is None:
+            snet_info = {}
+            for node in self.snet_nodes:
+                snet_info[node.node_id] = self.snet_state.get_node_info(node.node_id)
+                snet_info[node.node_id]['geoinfo'] = node.geoinfo
+            self.snet_info = snet_info
+        return self.snet_info
 
     def get_vnet_info(self):
         """
         Get virtual network information:
             virtual router status
+        The dictionary is built once and shared until a virtual network
+        changes (see vnet_changed), it must not be modified by the caller
         """
-        vnet_info = {}
-        for vnet in self.vnets:
-            vnet_info[vnet.vnet_id] = vnet.get_vnet_info()
-        return vnet_info
+        if self.vnet_info is None:
+            vnet_info = {}
+            for vnet in self.vnets:
+                vnet_info[vnet.vnet_id] = vnet.get_vnet_info()
+            self.vnet_info = vnet_info
+        return self.vnet_info
 
     def check_no_failure(self, failed_dict):
         """
@@ -449,9 +445,126 @@ class reconf_model(object):
         common_nodes = set.intersection(*set_list)
         return list(common_nodes)              
 
+class vnode_scenario(object):
+    """
+    a virtual router whose status is changed in a failure scenario, the 
+    other attributes refer to the ones of the base virtual router
+    """
+    __slots__ = ['vnode_id', 'status', 'vneighbors', 'neighbor_traffic', 
+                 'total_traffic']
+    
+    def __init__(self, vnode, status):
+        self.vnode_id = vnode.vnode_id
+        self.status = status
+        self.vneighbors = vnode.vneighbors
+        self.neighbor_traffic = vnode.neighbor_traffic
+        self.total_traffic = vnode.total_traffic
+        
+        
+class vnet_scenario(object):
+    """
+    a virtual network of a failure scenario, vnodes holds the base virtual 
+    routers except the ones changed in the scenario (see set_status), the 
+    base virtual network is not modified
+    """
+    __slots__ = ['vnet', 'vnet_id', 'vnodes', 'standby_ids']
+    
+    def __init__(self, vnet):
+        self.vnet = vnet
+        self.vnet_id = vnet.vnet_id
+        self.vnodes = list(vnet.vnodes)
+        self.standby_ids = vnet.get_standby_ids()
+        
+    def set_status(self, vnode_id, status):
+        ''' change the status of a virtual router in this scenario '''
+        self.vnodes[vnode_id] = vnode_scenario(self.vnet.vnodes[vnode_id], 
+                                               status)
+        
+    def add_standby(self, vnode_id):
+        ''' add a standby virtual router in this scenario '''
+        self.set_status(vnode_id, 2)
+        self.standby_ids.append(vnode_id)
+        
+    def get_standby_ids(self):
+        ''' get standby router ids '''
+        return list(self.standby_ids)
+        
+    def get_connected_ids(self):
+        ''' get connected router ids '''
+        return self.vnet.get_connected_ids()
+        
+    def random_fail(self, num_failure):
+        ''' generate random failures, see vnet.random_fail '''
+        return self.vnet.random_fail(num_failure)
+        
+    def get_vnet_info(self):
+        ''' get virtual network information, see vnet.get_vnet_info '''
+        vnet_dict = {}
+        vnet_dict['topo'] = self.vnet.vtopo.edges()
+        vnet_dict['up_nodes'] = self.get_connected_ids()
+        vnet_dict['standby'] = self.get_standby_ids()
+        vnet_dict['vnode_status'] = [vnode.status for vnode in self.vnodes]
+        vnet_dict['traffic'] = [(vnode.vnode_id, vnode.total_traffic) 
+                                for vnode in self.vnodes]
+        return vnet_dict
+        
+        
+class failure_scenario(object):
+    """
+    A failure scenario of the model. The failed virtual routers and the 
+    standby routers added in the scenario are recorded on top of the base 
+    model, which is shared by all the scenarios instead of being copied. 
+    The substrate state and the cost matrices are the ones of the base 
+    model, the scenario gives the read API of reconf_model used by 
+    ampl_gen, cplex_lp, highs_milp and heuristic_obj.
+    The base model is only changed by add_standby while a scenario is in 
+    use, which is followed by add_standby2 on the scenario
+    """
+    def __init__(self, model):
+        self.model = model
+        self.snet_nodes = model.snet_nodes
+        self.snet_state = model.snet_state
+        self.snet_topo = model.snet_topo
+        self.snet_type = model.snet_type
+        self.cost_dict = model.cost_dict
+        self.num_standby = model.num_standby
+        self.vnets = [vnet_scenario(vnet) for vnet in model.vnets]
+        self.failed_dict = {}
+        self.vnet_info = None
+        
+    def vnet_changed(self):
+        ''' drop the cached virtual network information, see reconf_model '''
+        self.vnet_info = None
+        
+    def get_snet_info(self):
+        ''' substrate network information of the base model '''
+        return self.model.get_snet_info()
+        
+    def get_vnet_info(self):
+        """
+        Get virtual network information of the scenario, the dictionary is
+        cached as in reconf_model.get_vnet_info
+        """
+        if self.vnet_info is None:
+            vnet_info = {}
+            for vnet in self.vnets:
+                vnet_info[vnet.vnet_id] = vnet.get_vnet_info()
+            self.vnet_info = vnet_info
+        return self.vnet_info
+        
+    def add_standby2(self, new_svr_dict):
+        """
+        Add the standby virtual routers added to the base model by 
+        add_standby (new_svr_dict) to this scenario
+        """
+        for vnet in self.vnets:
+            for new_id in new_svr_dict[vnet.vnet_id]:
+                vnet.add_standby(new_id)
+        self.vnet_changed()
+        
     def set_sfailure(self):
         """
-        Called by adjust_failure()
+        Called by adjust_failure_s()
         set failure type: substrate failure 
         input ftype = 's' 
         
@@ -461,7 +574,7 @@ class reconf_model(object):
         """
 
         failed_dict = {}
-        common_nodes = self.get_common_nodes()
+        common_nodes = self.model.get_common_nodes()
         fsnode = random.choice(common_nodes)
         for vnet in self.vnets:
             vnodes = vnet.vnodes
@@ -471,15 +584,16 @@ class reconf_model(object):
                 failed_dict[vnet.vnet_id] = fsnode
             for vnode in vnodes:
                 if vnode.vnode_id == fsnode:
-                    vnode.set_status(-1)
+                    vnet.set_status(vnode.vnode_id, -1)
                     #print "virtual network ", vnet.vnet_id, "failed ", vnode.vnode_id
                     break
+        self.vnet_changed()
         return failed_dict
 
             
     def set_vfailure(self, num_failure=1, fail_record=None):
         """
-        Called by adjust_failure()
+        Called by adjust_failure_v()
         set failure type: virtual network failure
         input ftype = 'v'
         
@@ -495,7 +609,7 @@ class reconf_model(object):
             for item in fail_record:
                 vnet_id = item[0]
                 fail_vr = item[1]
-                self.vnets[vnet_id - 1].vnodes[fail_vr].set_status(-1)
+                self.vnets[vnet_id - 1].set_status(fail_vr, -1)
                 #print "virtual network＃", vnet_id, "failed vr#", fail_vr
                 failed_dict[vnet_id] = fail_vr
         elif fail_record != [] and num_failure <= len(fail_record):
@@ -504,11 +618,12 @@ class reconf_model(object):
                 #print item
                 vnet_id = item[0]
                 fail_vr = item[1]
-                self.vnets[vnet_id - 1].vnodes[fail_vr].set_status(-1)
+                self.vnets[vnet_id - 1].set_status(fail_vr, -1)
                 failed_dict[vnet_id] = fail_vr
                 #print "vnet_id", vnet_id, "num_failrue", num_failure
                 if vnet_id > num_failure:
                     failed_dict[vnet_id] = -1
+            self.vnet_changed()
             return failed_dict, fail_record
      
         
@@ -521,7 +636,7 @@ class reconf_model(object):
                 if vnet.vnet_id not in failed_dict and new_failure > 0:
                     fvnode_id = vnet.random_fail(1)
                     if fvnode_id != -2:
-                        vnet.vnodes[fvnode_id].set_status(-1)
+                        vnet.set_status(fvnode_id, -1)
                         failed_dict[vnet.vnet_id] = fvnode_id
                         #print "virtual network＃", vnet.vnet_id, "failed vr#", fvnode_id
                         fail_record.append((vnet.vnet_id, fvnode_id))
@@ -533,7 +648,7 @@ class reconf_model(object):
                 else:
                     pass
         
-                
+        self.vnet_changed()
         return failed_dict, fail_record
                                     
 
@@ -548,8 +663,9 @@ def adjust_failure_s(model, num_failure):
     ftype reprentes the failure type is a physical failure
     num_failure is the total number failed virtual network
     If ftype = 's', num_failure takes default value 1
+    The scenario is a failure_scenario on top of the model
     """
-    model_f = deepcopy(model)
+    model_f = failure_scenario(model)
 
     failed_dict = model_f.set_sfailure()
     model_f.failed_dict = failed_dict   
@@ -568,8 +684,10 @@ def adjust_failure_v(model, num_failure, failure_record):
     (num_failure - 1). This is to provide a garantee that the new scenario is 
     created based on the previous scenario, that has the VNs has the same 
     failed VRs, and then generate a new failure.
+    The scenario is a failure_scenario on top of the model, the model is 
+    not copied
     """
-    model_f = deepcopy(model)
+    model_f = failure_scenario(model)
    
     failed_dict, fail_record = model_f.set_vfailure(num_failure, failure_record)
     model_f.failed_dict = failed_dict
@@ -664,25 +782,26 @@ def dryrun():
                                          str(theta3) + "_" + \
                                          limit_ext + "_" + \
                                          str(num_failure) + "_fail.dat"
-                                    shutil.copyfile(ampl_data, new_datafile)
+                                    data_out = ampl_gen.scenario_writer(ampl_data, new_datafile)
                                     #print min_standby, model_f.num_standby    
-                                    ampl_gen.change_standby_num(model, new_datafile, min_standby, model_f)
+                                    ampl_gen.change_standby_num(model, data_out, min_standby, model_f)
                                     min_standby = num_svr
                                     
             
                                     ampl_gen.change_weight(w_a, w_b, 
                                                            theta, 
-                                                           new_datafile)
+                                                           data_out)
                                     ampl_gen.change_limits(model_f, 
-                                                           new_datafile, 
+                                                           data_out, 
                                                            limit_ext)
                                     #print "print c"
                                     failed = ampl_gen.adjust_run(model_f, 
                                                                   snet_info, 
                                                                   num_vp, 
-                                                                  new_datafile)
+                                                                  data_out)
                                     # print link-path parameter in the ampl data file
-                                    demand_path, slink_dict, demand_dict = ampl_gen.print_link_path_param(model_f, new_datafile)
+                                    demand_path, slink_dict, demand_dict = ampl_gen.print_link_path_param(model_f, data_out)
+                                    data_out.close()
                                     calc_obj, select_dict, max_r, used_time = heuristic_obj.get_obj_new(model_f, demand_path, slink_dict, demand_dict,
                                                                      w_a, 
                                                                      w_b, 
@@ -704,13 +823,14 @@ def dryrun():
                 else:
                     (fname, part, ext) = ampl_data.partition('.')
                     new_datafile = fname + "_" + standby_limit + "_" + str(num_failure) + "fail.dat"
-                    shutil.copyfile(ampl_data, new_datafile)
+                    data_out = ampl_gen.scenario_writer(ampl_data, new_datafile)
                     model_f = adjust_failure_s(model, num_failure)
                     failed = ampl_gen.adjust_run(model_f, 
                                           snet_info, 
                                           num_vp, 
-                                          new_datafile)
+                                          data_out)
                     print failed
+                    data_out.close()
     
     return model, model_f, demand_path, slink_dict, demand_dict
     
@@ -773,6 +893,36 @@ def create_option(parser):
                       type="int",
                       default='37',
                       help="initial seed")
+    parser.add_option("--sparse", action="store_true",
+                      dest="sparse_c",
+                      default=False,
+                      help="print parameter c with only the nonzero entries")
+    parser.add_option("--overlay", action="store_true",
+                      dest="overlay",
+                      default=False,
+                      help="write each scenario as an overlay of the \
+                      template data file instead of a full copy")
+    parser.add_option("--lp", action="store_true",
+                      dest="write_lp",
+                      default=False,
+                      help="write the cplex lp file of each scenario \
+                      directly, without ampl expand (lp_gen.sh)")
+    parser.add_option("--improve", dest="improve_time",
+                      type="float",
+                      default=0,
+                      help="the time budget (seconds) of the local search \
+                      after the greedy heuristic, 0 to skip it")
+    parser.add_option("--workers", dest="num_workers",
+                      type="int",
+                      default=1,
+                      help="the number of worker processes to evaluate the \
+                      heuristic of the failure scenarios in parallel")
+    parser.add_option("--milp", action="store_true",
+                      dest="solve_milp",
+                      default=False,
+                      help="save the milp of each scenario as a npz file \
+                      to be solved by highs_milp.py (python 3), without \
+                      ampl and cplex")
                    
          
 def gen_theta(lamda_list,w_m):
@@ -793,7 +943,64 @@ def gen_theta(lamda_list,w_m):
         theta_list.append((theta1, theta2, theta3))
     return theta_list
 
-     
+def write_heuristic(heuristic_obj_file, grid_files, results, traces=None):
+    """
+    Append the heuristic results of a scenario grid to the heuristic obj
+    file, one line per data file:
+    data file, obj, used time, max utilization, selection
+    If the local search traces are given, they are appended to the 
+    <heuristic obj file>-improve.txt file, one line per data file:
+    data file, time:obj time:obj ...
+    """
+    fopen = open(heuristic_obj_file, 'a')
+    for new_datafile, result in zip(grid_files, results):
+        calc_obj, select_dict, max_r, used_time = result
+        fopen.write(new_datafile + ', ' + \
+                    str(calc_obj) + ', ' + \
+                    str(used_time) + ',' + \
+                    str(max_r) + ', ' + \
+                    str(select_dict) +'\n')
+    fopen.close()
+    if traces is not None:
+        (fname, part, ext) = heuristic_obj_file.rpartition('.')
+        fopen = open(fname + '-improve.txt', 'a')
+        for new_datafile, trace in zip(grid_files, traces):
+            points = ['%.6f:%s' % (elapsed, obj) for elapsed, obj in trace]
+            fopen.write(new_datafile + ', ' + ' '.join(points) + '\n')
+        fopen.close()
+
+def write_grid(heuristic_obj_file, grid_files, task_result):
+    """ write the (results, traces) of heuristic_obj.grid_task """
+    results, traces = task_result
+    write_heuristic(heuristic_obj_file, grid_files, results, traces)
+
+def write_pending(pending, wait=False):
+    """
+    Write the results of the tasks submitted to the worker pool in the 
+    order of submission. 
+    pending: a list of (AsyncResult, write function, arguments), a result
+    is written by write function(*arguments, result), the written tasks 
+    are removed from the front. If wait is False, stop at the first task
+    that is not finished yet
+    """
+    while pending and (wait or pending[0][0].ready()):
+        async_result, write_func, write_args = pending.pop(0)
+        write_func(*(write_args + (async_result.get(),)))
+
+def save_milp(milp_list, new_datafile, model_f, w_a, w_b, theta, limit, 
+              slink_dict, demand_dict, demand_path):
+    """
+    Save the milp of a data file as a npz file with the same name, and 
+    add the data file to the milp list file, they are solved by 
+    highs_milp.py under python 3 (scipy >= 1.9)
+    """
+    problem = highs_milp.build_milp(model_f, w_a, w_b, theta, limit, 
+                                    slink_dict, demand_dict, demand_path)
+    highs_milp.save_problem(problem, os.path.splitext(new_datafile)[0] + '.npz')
+    fopen = open(milp_list, 'a')
+    fopen.write(new_datafile + '\n')
+    fopen.close()
+
 def run(argv=None):
     """
     Create a template model with fixed configuration.
@@ -820,7 +1027,13 @@ def run(argv=None):
                     [--type snet_type] \
                     [--ftype fail_type] \
                     [--limit standby_limit] \
-                    [--seed seed_value]")
+                    [--seed seed_value] \
+                    [--sparse] \
+                    [--overlay] \
+                    [--lp] \
+                    [--improve improve_time] \
+                    [--workers num_workers] \
+                    [--milp]")
     parser = OptionParser(usage=usage)
     create_option(parser)
     (options, _) = parser.parse_args(argv)
@@ -834,6 +1047,12 @@ def run(argv=None):
     fail_type = options.fail_type
     standby_limit = options.standby_limit
     seed_value = options.seed_value
+    sparse_c = options.sparse_c
+    overlay = options.overlay
+    write_lp = options.write_lp
+    improve_time = options.improve_time
+    num_workers = options.num_workers
+    solve_milp = options.solve_milp
 
     
     heuristic_obj_file = snet_type + "-" + fail_type + \
@@ -841,7 +1060,21 @@ def run(argv=None):
     fopen = open(heuristic_obj_file, 'w')
     fopen.write("Heuristic Obj Values \n")
     fopen.close()
+    if improve_time > 0:
+        fopen = open(heuristic_obj_file[:-4] + "-improve.txt", 'w')
+        fopen.write("Local Search Traces (time:obj) \n")
+        fopen.close()
+    milp_list = heuristic_obj_file[:-4] + "-milp.lst"
+    if solve_milp:
+        fopen = open(milp_list, 'w')
+        fopen.close()
     random.seed(seed_value)
+    # the heuristic of each scenario is evaluated by a worker process, 
+    # the results are written in the order of the scenarios
+    pool = None
+    pending = []
+    if num_workers > 1:
+        pool = multiprocessing.Pool(num_workers)
     
     model = reconf_model()
     # Create substrate network
@@ -892,6 +1125,13 @@ def run(argv=None):
                 model_f, fail_record = adjust_failure_v(model, num_failure, fail_record)
                               
                 if standby_limit != 'inf' and standby_limit != 'rand':
+                    # the heuristic is evaluated for the whole grid of 
+                    # limit and weight points of the scenario at once
+                    grid = []
+                    grid_files = []
+                    traces = None
+                    if improve_time > 0:
+                        traces = []
                     # change the limit of standby
                     for limit in range(1, int(standby_limit) + 1, 2):
                         limit_ext = str(limit)
@@ -911,45 +1151,60 @@ def run(argv=None):
                                          str(theta3) + "_" + \
                                          limit_ext + "_" + \
                                          str(num_failure) + "_fail.dat"
-                                    shutil.copyfile(ampl_data, new_datafile)
+                                    data_out = ampl_gen.scenario_writer(ampl_data, new_datafile, overlay)
                                     #print min_standby, model_f.num_standby    
-                                    ampl_gen.change_standby_num(model, new_datafile, min_standby, model_f)
+                                    ampl_gen.change_standby_num(model, data_out, min_standby, model_f)
                                     min_standby = num_svr
                                     
             
                                     ampl_gen.change_weight(w_a, w_b, 
                                                            theta, 
-                                                           new_datafile)
+                                                           data_out)
                                     ampl_gen.change_limits(model_f, 
-                                                           new_datafile, 
+                                                           data_out, 
                                                            limit_ext)
                                     #print "print c"
                                     failed = ampl_gen.adjust_run(model_f, 
                                                                   snet_info, 
                                                                   num_vp, 
-                                                                  new_datafile)
-                                    demand_path, slink_dict, demand_dict = ampl_gen.print_link_path_param(model_f, new_datafile)
+                                                                  data_out,
+                                                                  sparse_c)
+                                    demand_path, slink_dict, demand_dict = ampl_gen.print_link_path_param(model_f, data_out)
+                                    data_out.close()
+                                    if write_lp:
+                                        lp_file = os.path.splitext(new_datafile)[0] + '.lp'
+                                        cplex_lp.write_lp(model_f, lp_file, w_a, w_b, theta, 
+                                                          limit_ext, slink_dict, 
+                                                          demand_dict, demand_path)
+                                    if solve_milp:
+                                        save_milp(milp_list, new_datafile, 
+                                                  model_f, w_a, w_b, theta, 
+                                                  limit_ext, slink_dict, 
+                                                  demand_dict, demand_path)
 #                                    calc_obj, select_dict, max_r, used_time = heuristic_obj.get_obj(model_f,
 #                                                                     w_a, 
 #                                                                     w_b, 
 #                                                                     theta, 
 #                                                                     limit)
-                                    calc_obj, select_dict, max_r, used_time = heuristic_obj.get_obj_new(model_f,
-                                                                     demand_path,
-                                                                     slink_dict,
-                                                                     demand_dict,
-                                                                     w_a, 
-                                                                     w_b, 
-                                                                     theta, 
-                                                                     limit)                                
-                            
-                                    #print new_datafile, calc_obj
-                                    fopen = open(heuristic_obj_file, 'a')
-                                    fopen.write(new_datafile + ', ' + \
-                                                str(calc_obj) + ', ' + \
-                                                str(used_time) + ',' + \
-                                                str(max_r) + ', ' + \
-                                                str(select_dict) +'\n')
+                                    grid.append((w_a, w_b, theta, limit))
+                                    grid_files.append(new_datafile)
+                    if pool is not None:
+                        pending.append((heuristic_obj.submit_grid(pool, model_f, 
+                                                                  demand_path, 
+                                                                  slink_dict, 
+                                                                  demand_dict,
+                                                                  grid, 
+                                                                  improve_time), 
+                                        write_grid, 
+                                        (heuristic_obj_file, grid_files)))
+                        write_pending(pending)
+                    else:
+                        results = heuristic_obj.get_obj_grid(model_f, demand_path,
+                                                             slink_dict, demand_dict, 
+                                                             grid, improve_time,
+                                                             traces)
+                        write_heuristic(heuristic_obj_file, grid_files, results,
+                                        traces)
                 
               
     if fail_type == 's':
@@ -957,6 +1212,11 @@ def run(argv=None):
         model_f = adjust_failure_s(model, num_failure)
         for num_svr in range(min_standby, max_standby+1, 2):
             model.num_standby = num_svr
+            grid = []
+            grid_files = []
+            traces = None
+            if improve_time > 0:
+                traces = []
             #for limit in range(1, int(standby_limit) + 1, 2):
             for limit in range(1, int(10) + 1, 2):
                 limit_ext = str(limit)
@@ -976,36 +1236,48 @@ def run(argv=None):
                                          str(theta3) + "_" + \
                                          limit_ext + "_" + \
                                          str(num_failure) + "_fail.dat"
-                            shutil.copyfile(ampl_data, new_datafile)
-                            ampl_gen.change_standby_num(model, new_datafile, min_standby, model_f)
+                            data_out = ampl_gen.scenario_writer(ampl_data, new_datafile, overlay)
+                            ampl_gen.change_standby_num(model, data_out, min_standby, model_f)
                             min_standby = num_svr
                             ampl_gen.change_weight(w_a, w_b, 
                                                            theta, 
-                                                           new_datafile)
+                                                           data_out)
                             ampl_gen.change_limits(model_f, 
-                                                           new_datafile, 
+                                                           data_out, 
                                                            limit_ext)
                             failed = ampl_gen.adjust_run(model_f, 
                                                                   snet_info, 
                                                                   num_vp, 
-                                                                  new_datafile)
+                                                                  data_out,
+                                                                  sparse_c)
                                                
 
-                            demand_path, slink_dict, demand_dict = ampl_gen.print_link_path_param(model_f, new_datafile)
-                            calc_obj, select_dict, max_r, used_time = heuristic_obj.get_obj_new(model_f,
-                                                             demand_path,
-                                                             slink_dict,
-                                                             demand_dict,
-                                                             w_a, 
-                                                             w_b, 
-                                                             theta, 
-                                                             limit)                                                              
-                            fopen = open(heuristic_obj_file, 'a')
-                            fopen.write(new_datafile + ', ' + \
-                                                str(calc_obj) + ', ' + \
-                                                str(used_time) + ',' + \
-                                                str(max_r) + ', ' + \
-                                                str(select_dict) +'\n')
+                            demand_path, slink_dict, demand_dict = ampl_gen.print_link_path_param(model_f, data_out)
+                            data_out.close()
+                            if write_lp:
+                                lp_file = os.path.splitext(new_datafile)[0] + '.lp'
+                                cplex_lp.write_lp(model_f, lp_file, w_a, w_b, theta, 
+                                                  limit_ext, slink_dict, 
+                                                  demand_dict, demand_path)
+                            if solve_milp:
+                                save_milp(milp_list, new_datafile, model_f, 
+                                          w_a, w_b, theta, limit_ext, 
+                                          slink_dict, demand_dict, demand_path)
+                            grid.append((w_a, w_b, theta, limit))
+                            grid_files.append(new_datafile)
+            if pool is not None:
+                pending.append((heuristic_obj.submit_grid(pool, model_f, 
+                                                          demand_path, 
+                                                          slink_dict, 
+                                                          demand_dict, grid,
+                                                          improve_time), 
+                                write_grid, (heuristic_obj_file, grid_files)))
+                write_pending(pending)
+            else:
+                results = heuristic_obj.get_obj_grid(model_f, demand_path,
+                                                     slink_dict, demand_dict, grid,
+                                                     improve_time, traces)
+                write_heuristic(heuristic_obj_file, grid_files, results, traces)
 #        (fname, part, ext) = ampl_data.partition('.')
 #        new_datafile = fname + "_" + str(num_failure) + "fail.dat"
 #        shutil.copyfile(ampl_data, new_datafile)
@@ -1014,6 +1286,10 @@ def run(argv=None):
 #                                          num_vp, 
 #                                          new_datafile)
 #        print failed
+    if pool is not None:
+        write_pending(pending, wait=True)
+        pool.close()
+        pool.join()
     fopen.close()   
         
 if __name__ == '__main__':
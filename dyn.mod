@@ -83,7 +83,8 @@ param num_fail {j in VNet} = card {Fail[j]} >= 0;
 param e { j in VNet, i in PRouter, k in PRouter: i <> k} binary;
 
 # requested bw on the virtual interface m of standby virtual router r_{i,j} ------- (c^{j,f}_{i,m,k}) 
-param c { j in VNet, f in Fail[j], i in PRouter, m in VIface[i,j], k in PRouter: i <> k} >= 0;
+# (only the nonzero entries may be given in the data file, the others are 0)
+param c { j in VNet, f in Fail[j], i in PRouter, m in VIface[i,j], k in PRouter: i <> k} >= 0 default 0;
 
 
 ##  Start Link-Path Formulation ----------
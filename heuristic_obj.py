@@ -9,10 +9,9 @@ Created on Wed Apr  9 14:19:34 2014
 @author: xuanliu
 """
 import operator
-import copy
-import networkx as nx
 import time
 import random
+import numpy as np
 
 def operation_cost(tau=0):
     """
@@ -36,12 +35,11 @@ def dist_cost(s_vr, failed_vr, neighbor_vr, dist_matrix, w_a1, w_a2):
     neighbor_vr: the failed virtual router's neighbor id
     w_a1: the weight parameter for the distance between s_vr and failed_vr
     w_a2: the weight parameter for the distance between s_vr and neighbor_vr
-    dist_matrix: the distance matrix for all substrate nodes
-    (Note: the first column in the dist_matrix is index)
+    dist_matrix: the numeric distance matrix for all substrate nodes
     """
     #print s_vr, failed_vr, neighbor_vr
-    dist_i_f = dist_matrix[s_vr][failed_vr + 1]
-    dist_i_k = dist_matrix[s_vr][neighbor_vr + 1]
+    dist_i_f = dist_matrix[s_vr, failed_vr]
+    dist_i_k = dist_matrix[s_vr, neighbor_vr]
     dist = w_a1 * float(dist_i_f) + w_a2 * float(dist_i_k)
     #print "d_i_f: ", dist_i_f, ", dist_i_k: ", dist_i_k
     return dist
@@ -56,10 +54,9 @@ def rtt_cost(s_vr, neighbor_vr, rtt_matrix):
     Inputs are:
     s_vr: the candidate standby virtual router id
     neighbor_vr: the failed irtual router id
-    rtt_matrix: the RTT matrix for all virtual nodes (full mesh)
-    (Note: the first column in the RTT_matrix is index)
+    rtt_matrix: the numeric RTT matrix for all virtual nodes (full mesh)
     """
-    rtt = rtt_matrix[s_vr][neighbor_vr + 1]
+    rtt = rtt_matrix[s_vr, neighbor_vr]
     #print "rtt_i_k", rtt
     return float(rtt)
     
@@ -75,15 +72,9 @@ def resource_cost(bw_matrix, standby_vr):
     """
     Get the residul capacity on the substrate nodes
     """
-    #host_cpu = float(cpu_info[0][standby_vr])
-    host_bw = 0
-    num_rows = len(bw_matrix)
-    #num_cols = len(bw_matrix[1,:])
-    for port in range(num_rows):
-        if bw_matrix[port][standby_vr] != '.':
-            host_bw += float(bw_matrix[port][standby_vr])
-        else:
-            pass
+    #host_cpu = cpu_info[0, standby_vr]
+    # missing ports are NaN in the bw matrix
+    host_bw = float(np.nansum(bw_matrix[:, standby_vr]))
     #return host_cpu * host_bw
     return host_bw
     
@@ -92,31 +83,18 @@ def total_bw(bw_matrix):
     return the total residual bw for each snet node, in the form of list,
     where the index is the node id
     """
-    node_bw_list = []
-    num_col = len(bw_matrix[0])
-    num_row = len(bw_matrix)
-    for node_id in range(num_col):
-        temp_bw = 0
-        for port in range(num_row):
-            if bw_matrix[port][node_id] != '.':
-                temp_bw += float(bw_matrix[port][node_id])
-            else:
-                pass
-        node_bw_list.append(round(temp_bw, 5))
-    return node_bw_list
+    node_bw = np.round(np.nansum(bw_matrix, axis=0), 5)
+    return node_bw.tolist()
      
 def total_port(model):
     """
-    get total number of ports for each node
+    get total number of ports for each node, and the bw used on each node,
+    from the substrate state of the model (see substrate.snet_state)
     """
-    snet_info = model.get_snet_info()
-    used_bw_list = []
-    node_port_list = []
-    for node_id in snet_info:
-        number_port = snet_info[node_id]['num_iface']
-        node_port_list.append(number_port)
-        used_bw = number_port - snet_info[node_id]['sum_avail_bw']
-        used_bw_list.append(round(used_bw, 5))
+    snet_state = model.snet_state
+    node_port_list = snet_state.num_iface.tolist()
+    used_bw = snet_state.num_iface - snet_state.total_avail_bw
+    used_bw_list = [round(bw, 5) for bw in used_bw.tolist()]
     return node_port_list, used_bw_list
         
     
@@ -206,9 +184,130 @@ def total_port(model):
 #    return selected_dict   
  
  
-def find_random(model,limit, w_a, w_b, w_m, demand_path, demand_dict, slink_dict):
+def candidate_terms(model):
+    """
+    The weight independent parts of the connectivity cost of all the standby
+    candidates of all the failed virtual networks. For candidate i of a 
+    failed router f with neighbors k: dist[i, f], sum_k dist[i, k] and 
+    sum_k rtt[i, k]. The (vnet, candidate) rows of all vnets are gathered 
+    from the dist and rtt matrices together, one neighbor column at a time
+    Return a dictionary with:
+    vn_ids: [(vnet_id, standby_list)], row_ptr: the rows of the n-th vnet
+    are row_ptr[n]:row_ptr[n+1], dist_f, dist_k, rtt_k: arrays over rows
+    """
+    failed_dict = model.failed_dict
+    dist_matrix = model.cost_dict['dist']
+    rtt_matrix = model.cost_dict['rtt']
+    vn_ids = []
+    row_ptr = [0]
+    row_svr = []
+    row_fvr = []
+    row_nbrs = []
+    for vnet in model.vnets:
+        failed_vr = failed_dict[vnet.vnet_id]
+        if failed_vr == -1:
+            continue
+        standby_list = vnet.get_standby_ids()
+        vneighbors = list(vnet.vnodes[failed_vr].vneighbors)
+        vn_ids.append((vnet.vnet_id, standby_list))
+        row_svr.extend(standby_list)
+        row_fvr.extend([failed_vr] * len(standby_list))
+        row_nbrs.extend([vneighbors] * len(standby_list))
+        row_ptr.append(len(row_svr))
+    max_nbr = max([len(nbrs) for nbrs in row_nbrs] + [0])
+    # neighbor table of the rows, padded with node 0 and masked out
+    nbr_table = np.array([nbrs + [0] * (max_nbr - len(nbrs)) 
+                          for nbrs in row_nbrs], dtype=int).reshape(-1, max_nbr)
+    nbr_mask = np.array([[1] * len(nbrs) + [0] * (max_nbr - len(nbrs)) 
+                         for nbrs in row_nbrs], dtype=bool).reshape(-1, max_nbr)
+    row_svr = np.array(row_svr, dtype=int)
+    row_fvr = np.array(row_fvr, dtype=int)
+    dist_f = dist_matrix[row_svr, row_fvr]
+    dist_k = np.zeros(len(row_svr))
+    rtt_k = np.zeros(len(row_svr))
+    for col in range(max_nbr):
+        nbr_col = nbr_table[:, col]
+        dist_k += np.where(nbr_mask[:, col], dist_matrix[row_svr, nbr_col], 0)
+        rtt_k += np.where(nbr_mask[:, col], rtt_matrix[row_svr, nbr_col], 0)
+    terms = {}
+    terms['vn_ids'] = vn_ids
+    terms['row_ptr'] = row_ptr
+    terms['dist_f'] = dist_f
+    terms['dist_k'] = dist_k
+    terms['rtt_k'] = rtt_k
+    return terms
+    
+def connect_cost_table(model, w_a, w_b, terms=None):
+    """
+    Connectivity cost of all the standby candidates of all the failed 
+    virtual networks, in the form of {vnet_id: (standby_list, cost array)}
+    cost of candidate i of a failed router f with neighbors k:
+    w_b1 * (w_a1 * dist[i, f] + w_a2 * sum_k dist[i, k]) + w_b2 * sum_k rtt[i, k]
+    terms: the weight independent parts, see candidate_terms
+    """
+    if terms is None:
+        terms = candidate_terms(model)
+    row_ptr = terms['row_ptr']
+    connect = w_b[0] * (w_a[0] * terms['dist_f'] + w_a[1] * terms['dist_k']) + \
+              w_b[1] * terms['rtt_k']
+    connect_table = {}
+    for index, (vnet_id, standby_list) in enumerate(terms['vn_ids']):
+        connect_table[vnet_id] = (standby_list, 
+                                  connect[row_ptr[index]:row_ptr[index + 1]])
+    return connect_table
+    
+def candidate_demands(model, demand_dict):
+    """
+    The capacity demands of each standby candidate of the failed virtual 
+    networks, {(vnet_id, svr): [(demand_id, capacity)]}, in the order of
+    the failed router's neighbors
+    """
+    failed_dict = model.failed_dict
+    demands = {}
+    for vnet in model.vnets:
+        failed_vr = failed_dict[vnet.vnet_id]
+        if failed_vr == -1:
+            continue
+        vneighbors = vnet.vnodes[failed_vr].vneighbors
+        for s_vr in vnet.get_standby_ids():
+            demand_list = []
+            for k in vneighbors:
+                demand_id = find_demand_id(demand_dict, vnet.vnet_id, 
+                                           failed_vr + 1, s_vr + 1, k + 1)
+                demand_list.append((demand_id, 
+                                    demand_dict[demand_id]['capacity']))
+            demands[(vnet.vnet_id, s_vr)] = demand_list
+    return demands
+    
+def prepare_scenario(model, demand_dict, demand_path):
+    """
+    Compute the weight independent parts of the heuristic for a failure 
+    scenario once, to be shared by the evaluations of all the weight and
+    limit points (see get_obj_grid):
+    sorted_vn: the vnets in the order of the failed router's traffic
+    terms: the connectivity terms of the candidates, see candidate_terms
+    demands: the capacity demands of the candidates, see candidate_demands
+    path_table: the candidate paths of the demands, see path_table
+    node_bw_list: the total bw of each substrate node
+    node_port_list, used_bw_list: see total_port
+    vnet_info: model.get_vnet_info()
+    """
+    prep = {}
+    prep['sorted_vn'] = sort_vnet(model)
+    prep['terms'] = candidate_terms(model)
+    prep['demands'] = candidate_demands(model, demand_dict)
+    prep['path_table'] = path_table(demand_path, prep['demands'])
+    prep['node_bw_list'] = total_bw(model.cost_dict['bw'])
+    prep['node_port_list'], prep['used_bw_list'] = total_port(model)
+    prep['vnet_info'] = model.get_vnet_info()
+    return prep
+    
+    
+def find_random(model,limit, w_a, w_b, w_m, demand_path, demand_dict, slink_dict, prep=None):
     """
     find random standby
+    slink_dict: the link_state the selected paths are allocated on
+    prep: the weight independent parts of the scenario, see prepare_scenario
     """
     failed_dict = model.failed_dict
     #print failed_dict, limit
@@ -218,9 +317,18 @@ def find_random(model,limit, w_a, w_b, w_m, demand_path, demand_dict, slink_dict
     #cpu_vector = model.cost_dict['cpu']
     selected_dict = {}
     
-    snode_bw_list = total_bw(bw_matrix)
+    if prep is None:
+        prep = prepare_scenario(model, demand_dict, demand_path)
+    # total bw of each substrate node, computed once, and the residual bw 
+    # updated in place as the standbys are selected
+    node_bw_list = prep['node_bw_list']
+    snode_bw_list = list(node_bw_list)
+    # number of standbys selected on each substrate node
+    host_count = [0] * len(node_bw_list)
     #vnet_set = model.vnets
-    sorted_vn = sort_vnet(model)
+    sorted_vn = prep['sorted_vn']
+    connect_table = connect_cost_table(model, w_a, w_b, prep['terms'])
+    paths = prep['path_table']
     if w_m[2] >= 10*w_m[1]:
         threshold = 0.3
     else:
@@ -231,81 +339,64 @@ def find_random(model,limit, w_a, w_b, w_m, demand_path, demand_dict, slink_dict
         failed_vr = failed_dict[vnet.vnet_id]
         if failed_vr != -1: 
             # this node is failed
-            standby_list = vnet.get_standby_ids()
-            standby_cost = {}
-            for s_vr in standby_list:
-                dist_f = float(dist_matrix[s_vr][failed_vr + 1])
-                failed_node = vnet.vnodes[failed_vr]
-                vneighbors = failed_node.vneighbors
-                dist_k = 0
-                rtt_k = 0
-                for k in vneighbors:
-                    dist_k += float(dist_matrix[s_vr][k + 1])
-                    rtt_k += float(rtt_matrix[s_vr][k + 1])
-
-                connect_cost = w_b[0] * (w_a[0] * dist_f + w_a[1] * dist_k) +\
-                                w_b[1] * rtt_k
-                res_cost = snode_bw_list[s_vr]
-                req_bw = sum(failed_node.neighbor_traffic.values())
-                total = w_m[1] * connect_cost + w_m[2] * req_bw / res_cost
-                standby_cost[s_vr] = total
+            failed_node = vnet.vnodes[failed_vr]
+            vneighbors = failed_node.vneighbors
+            standby_list, connect_cost = connect_table[vnet.vnet_id]
+            # the resource part uses the current residual bw
+            res_cost = np.take(snode_bw_list, standby_list)
+            req_bw = sum(failed_node.neighbor_traffic.values())
+            total = w_m[1] * connect_cost + w_m[2] * req_bw / res_cost
+            standby_cost = dict(zip(standby_list, total.tolist()))
             sorted_x  = []
             for item in standby_cost:
                 sorted_x.append((item, standby_cost[item]))
             
             random.shuffle(sorted_x)
+            # the least utilized candidate does not change until a standby
+            # is selected for this vnet, it is found once when needed
+            min_id = None
             for item in sorted_x:
                 if item[0] not in snode_traffic:
-                    utilization = vn_traffic[1] / total_bw(bw_matrix)[item[0]]
+                    utilization = vn_traffic[1] / node_bw_list[item[0]]
                 else:
-                    utilization = (snode_traffic[item[0]] + vn_traffic[1]) / total_bw(bw_matrix)[item[0]]
+                    utilization = (snode_traffic[item[0]] + vn_traffic[1]) / node_bw_list[item[0]]
                 #print utilization
                 # Link-Path selsection add-on
                 path_alloc = 1
-                for k in vneighbors:
-                    demand_id = find_demand_id(demand_dict, vnet.vnet_id, failed_vr + 1,
-                                               item[0] + 1, k + 1)
-                    demand = demand_dict[demand_id]['capacity']
-                    find, path = find_path(demand_path, demand_id, 
-                                     slink_dict, demand) 
-                    if find == 0:
-                        print "No available path between svr and nbr on the substrate network" 
-                        path_alloc = 0
-                    #print "FIND PATH", find, path
+                num_fail, path = paths.candidate_path(vnet.vnet_id, item[0], 
+                                                      slink_dict)
+                if num_fail > 0:
+                    print "No available path between svr and nbr on the substrate network" 
+                    path_alloc = 0
                 # End link-path block 
                 #print "ALLOCATED: ", path_alloc
                 if path_alloc == 1:
-                    if selected_dict.values().count(item[0]) < limit:
+                    if host_count[item[0]] < limit:
                         if utilization < threshold and w_m[2] >= 10*w_m[1]:
                             if item[0] not in snode_traffic: 
                                 selected_dict[vnet.vnet_id] = item[0]
+                                host_count[item[0]] += 1
                                 snode_bw_list[item[0]] -= vn_traffic[1]
                                 snode_traffic[item[0]] = vn_traffic[1]
-                                for slink_id in path:
-                                    #print vn_traffic[1], slink_dict[slink_id]['capacity']
-                                    slink_dict[slink_id]['capacity'] = slink_dict[slink_id]['capacity'] - vn_traffic[1]
-                                    #print slink_dict[slink_id]['capacity']
+                                slink_dict.change_path(path, -vn_traffic[1])
                                 break;
                             else:
-                                min_id = find_min(sorted_x, bw_matrix, snode_traffic, vn_traffic[1]) 
+                                if min_id is None:
+                                    min_id = find_min(sorted_x, node_bw_list, snode_traffic, vn_traffic[1])
                                 if min_id == item[0]:
                                     selected_dict[vnet.vnet_id] = item[0]
+                                    host_count[item[0]] += 1
                                     snode_bw_list[item[0]] -= vn_traffic[1]
                                     snode_traffic[item[0]] = vn_traffic[1]
-                                    for slink_id in path:
-                                        #print vn_traffic[1],slink_dict[slink_id]['capacity']
-                                        slink_dict[slink_id]['capacity'] = slink_dict[slink_id]['capacity'] - vn_traffic[1]
-                                        #print slink_dict[slink_id]['capacity']
+                                    slink_dict.change_path(path, -vn_traffic[1])
                                 #threshold = (threshold + 0.01)/2
                                     break
                         elif utilization < threshold:
                             selected_dict[vnet.vnet_id] = item[0]
+                            host_count[item[0]] += 1
                             snode_bw_list[item[0]] -= vn_traffic[1]
                             snode_traffic[item[0]] = vn_traffic[1]
-                            for slink_id in path:
-                                #print vn_traffic[1],slink_dict[slink_id]['capacity']
-                                slink_dict[slink_id]['capacity'] = slink_dict[slink_id]['capacity'] - vn_traffic[1]
-                                #print slink_dict[slink_id]['capacity']
+                            slink_dict.change_path(path, -vn_traffic[1])
                             break
                         else:
                             print "does not satisfy the threshold"  
@@ -319,10 +410,14 @@ def find_random(model,limit, w_a, w_b, w_m, demand_path, demand_dict, slink_dict
     #print slink_dict                       
     return selected_dict, slink_dict
  
-def find_standby2(model, limit, w_a, w_b, w_m, demand_path, demand_dict, slink_dict):
+def find_standby2(model, limit, w_a, w_b, w_m, demand_path, demand_dict, slink_dict, prep=None, path_dict=None):
     """
     Heuristic algorithm to find the standby virtual router
     for each virtual network
+    slink_dict: the link_state the selected paths are allocated on
+    prep: the weight independent parts of the scenario, see prepare_scenario
+    path_dict: if given, the path allocated for each selected vnet is 
+    recorded in it, {vnet_id: path}
     """
     #print slink_dict
     #print "FIND"
@@ -334,13 +429,22 @@ def find_standby2(model, limit, w_a, w_b, w_m, demand_path, demand_dict, slink_d
     #cpu_vector = model.cost_dict['cpu']
     selected_dict = {}
     
-    # get aggregated residual bw for all substrate nodes, and store it as a list
-    snode_bw_list = total_bw(bw_matrix)
+    if prep is None:
+        prep = prepare_scenario(model, demand_dict, demand_path)
+    # get aggregated bw for all substrate nodes once, and store it as a list,
+    # the residual bw list is updated in place as the standbys are selected
+    node_bw_list = prep['node_bw_list']
+    snode_bw_list = list(node_bw_list)
+    # number of standbys selected on each substrate node
+    host_count = [0] * len(node_bw_list)
     
     # get total capacity and used bw for each snode
-    node_port_list, used_bw_list = total_port(model)
+    node_port_list = prep['node_port_list']
+    used_bw_list = prep['used_bw_list']
     #vnet_set = model.vnets
-    sorted_vn = sort_vnet(model)
+    sorted_vn = prep['sorted_vn']
+    connect_table = connect_cost_table(model, w_a, w_b, prep['terms'])
+    paths = prep['path_table']
 
     #for vnet in vnet_set:
     if w_m[2] >= 10*w_m[1]:
@@ -353,26 +457,19 @@ def find_standby2(model, limit, w_a, w_b, w_m, demand_path, demand_dict, slink_d
         failed_vr = failed_dict[vnet.vnet_id]
         if failed_vr != -1: 
             # this node is failed
-            standby_list = vnet.get_standby_ids()
-            standby_cost = {}
-            for s_vr in standby_list:
-                dist_f = float(dist_matrix[s_vr][failed_vr + 1])
-                failed_node = vnet.vnodes[failed_vr]
-                vneighbors = failed_node.vneighbors
-                dist_k = 0
-                rtt_k = 0
-                for k in vneighbors:
-                    dist_k += float(dist_matrix[s_vr][k + 1])
-                    rtt_k += float(rtt_matrix[s_vr][k + 1])
-
-                connect_cost = w_b[0] * (w_a[0] * dist_f + w_a[1] * dist_k) +\
-                                w_b[1] * rtt_k
-                res_cost = snode_bw_list[s_vr]
-                req_bw = sum(failed_node.neighbor_traffic.values())
-                total = w_m[1] * connect_cost + w_m[2] * req_bw / res_cost
-                standby_cost[s_vr] = total
+            failed_node = vnet.vnodes[failed_vr]
+            vneighbors = failed_node.vneighbors
+            standby_list, connect_cost = connect_table[vnet.vnet_id]
+            # the resource part uses the current residual bw
+            res_cost = np.take(snode_bw_list, standby_list)
+            req_bw = sum(failed_node.neighbor_traffic.values())
+            total = w_m[1] * connect_cost + w_m[2] * req_bw / res_cost
+            standby_cost = dict(zip(standby_list, total.tolist()))
             sorted_x = sorted(standby_cost.iteritems(), key=operator.itemgetter(1))
             #print "SORTED", sorted_x
+            # the least utilized candidate does not change until a standby
+            # is selected for this vnet, it is found once when needed
+            min_id = None
             
             for item in sorted_x:
                 if item[0] not in snode_traffic:
@@ -384,53 +481,49 @@ def find_standby2(model, limit, w_a, w_b, w_m, demand_path, demand_dict, slink_d
                 #print utilization
                 # Link-Path selsection add-on
                 path_alloc = 1
-                for k in vneighbors:
-                    demand_id = find_demand_id(demand_dict, vnet.vnet_id, failed_vr + 1,
-                                               item[0] + 1, k + 1)
-                    demand = demand_dict[demand_id]['capacity']
-                    find, path = find_path(demand_path, demand_id, 
-                                     slink_dict, demand) 
-                    if find == 0:
-                        print "No available path between svr and nbr on the substrate network" 
-                        path_alloc = 0
-                    #print "FIND PATH", find, path
+                num_fail, path = paths.candidate_path(vnet.vnet_id, item[0], 
+                                                      slink_dict)
+                if num_fail > 0:
+                    print "No available path between svr and nbr on the substrate network" 
+                    path_alloc = 0
                 # End link-path block 
                 #print "ALLOCATED: ", path_alloc
                 if path_alloc == 1:
-                    if selected_dict.values().count(item[0]) < limit:
+                    if host_count[item[0]] < limit:
                         if utilization < threshold and w_m[2] >= 10*w_m[1]:
                             if item[0] not in snode_traffic: 
                                 selected_dict[vnet.vnet_id] = item[0]
+                                host_count[item[0]] += 1
+                                if path_dict is not None:
+                                    path_dict[vnet.vnet_id] = path
                                 snode_bw_list[item[0]] -= vn_traffic[1]
                                 snode_traffic[item[0]] = vn_traffic[1]
-                                for slink_id in path:
-                                    #print vn_traffic[1], slink_dict[slink_id]['capacity']
-                                    slink_dict[slink_id]['capacity'] = slink_dict[slink_id]['capacity'] - vn_traffic[1]
-                                    #print slink_dict[slink_id]['capacity']
+                                slink_dict.change_path(path, -vn_traffic[1])
                                 break;
                             else:
-                                min_id = find_min(sorted_x, bw_matrix, snode_traffic, vn_traffic[1]) 
+                                if min_id is None:
+                                    min_id = find_min(sorted_x, node_bw_list, snode_traffic, vn_traffic[1])
                                 if min_id == item[0]:
                                     selected_dict[vnet.vnet_id] = item[0]
+                                    host_count[item[0]] += 1
+                                    if path_dict is not None:
+                                        path_dict[vnet.vnet_id] = path
                                     snode_bw_list[item[0]] -= vn_traffic[1]
                                     snode_traffic[item[0]] += vn_traffic[1]
-                                    for slink_id in path:
-                                        #print vn_traffic[1],slink_dict[slink_id]['capacity']
-                                        slink_dict[slink_id]['capacity'] = slink_dict[slink_id]['capacity'] - vn_traffic[1]
-                                        #print slink_dict[slink_id]['capacity']
+                                    slink_dict.change_path(path, -vn_traffic[1])
                                 #threshold = (threshold + 0.01)/2
                                     break
                         elif utilization < threshold:
                             selected_dict[vnet.vnet_id] = item[0]
+                            host_count[item[0]] += 1
+                            if path_dict is not None:
+                                path_dict[vnet.vnet_id] = path
                             snode_bw_list[item[0]] -= vn_traffic[1]
                             if item[0] not in snode_traffic: 
                                 snode_traffic[item[0]] = vn_traffic[1]
                             else:
                                 snode_traffic[item[0]] += vn_traffic[1]
-                            for slink_id in path:
-                                #print vn_traffic[1],slink_dict[slink_id]['capacity']
-                                slink_dict[slink_id]['capacity'] = slink_dict[slink_id]['capacity'] - vn_traffic[1]
-                                #print slink_dict[slink_id]['capacity']
+                            slink_dict.change_path(path, -vn_traffic[1])
                             break
                         else:
                             print "does not satisfy the threshold"  
@@ -444,19 +537,21 @@ def find_standby2(model, limit, w_a, w_b, w_m, demand_path, demand_dict, slink_d
     #print slink_dict                       
     return selected_dict, slink_dict
     
-def find_min(sorted_x, bw_matrix, snode_traffic, traffic_req):
-    ''' find the minimum utilization '''
-    min_id = 0
-    min_util = 1
-    for item in sorted_x:
-        if item[0] not in snode_traffic:
-            utilization = traffic_req / total_bw(bw_matrix)[item[0]]
-        else:
-            utilization = (snode_traffic[item[0]] + traffic_req) / total_bw(bw_matrix)[item[0]]
-        if utilization < min_util:
-            min_id = item[0]
-            min_util = utilization
-    return min_id
+def find_min(sorted_x, node_bw_list, snode_traffic, traffic_req):
+    """
+    find the candidate with the minimum projected utilization (the first 
+    one in the order of sorted_x on ties), it is returned if the 
+    utilization is less than 1, 0 otherwise
+    node_bw_list: the total bw of each substrate node, see total_bw
+    """
+    def utilization(item):
+        return (snode_traffic.get(item[0], 0) + traffic_req) / node_bw_list[item[0]]
+    if not sorted_x:
+        return 0
+    min_item = min(sorted_x, key=utilization)
+    if utilization(min_item) < 1:
+        return min_item[0]
+    return 0
     
 def sort_vnet(model, option='traffic'):
     """
@@ -543,9 +638,12 @@ def sort_vnet(model, option='traffic'):
 
 def find_demand_id(demand_dict, vn_id, fvr_id, svr, nbr):
     """
-    find the demand_id for a particular demand
+    find the demand_id for a particular demand, from the index of the 
+    demand table (ampl_gen.demand_table), or by a scan over a plain dict
     """
     #print vn_id, fvr_id, svr, nbr
+    if hasattr(demand_dict, 'find'):
+        return demand_dict.find(vn_id, fvr_id, svr, nbr)
     for demand_id in demand_dict:
         if vn_id == demand_dict[demand_id]['vn_id'] and \
             fvr_id == demand_dict[demand_id]['fnode_id'] and \
@@ -553,59 +651,83 @@ def find_demand_id(demand_dict, vn_id, fvr_id, svr, nbr):
             nbr == demand_dict[demand_id]['nbr_id']:
             return demand_id
     
-def find_path(demand_path, demand_id, slink_dict, demand):
+class link_state(object):
     """
-    If find a path with sufficient capacity, return 1, 0 otherwise
+    Substrate link capacities for the path allocation of the heuristic, 
+    as a python list of capacities indexed by slink id, instead of the 
+    slink_dict[slink_id]['capacity'] lookups
     """
-    find = 0
-    all_paths = demand_path[demand_id]
-    #print all_paths
-    for path_id in all_paths:
-        path = all_paths[path_id]
-        #print path
-        min_capacity = get_min_capacity_path(path, slink_dict)
-        #print demand, min_capacity
-        if demand < min_capacity:
-            find = 1
-            break
-    return find, path
-    
-def get_min_capacity_path(path, slink_dict):
+    def __init__(self, slink_dict):
+        self.capacity = [0] * (max(slink_dict) + 1)
+        for slink_id in slink_dict:
+            self.capacity[slink_id] = slink_dict[slink_id]['capacity']
+            
+    def change_path(self, path, traffic):
+        ''' add traffic to the capacity of the links of a path '''
+        capacity = self.capacity
+        for slink_id in path:
+            capacity[slink_id] += traffic
+            
+            
+class path_table(object):
     """
-    Get the bottle neck link in the path
+    The candidate paths of the demands of the standby candidates, see 
+    candidate_demands. The paths of a candidate are looked up when it is 
+    checked for the first time and kept for all the (theta, limit) points
+    of the scenario:
+    cand_paths: {(vnet_id, svr): [(demand, [path])]}, the paths of a 
+    demand in the order of demand_path
     """
-    capacity_list = []
-    for slink_id in path:
-        capacity_list.append(slink_dict[slink_id]['capacity'])
-    return min(capacity_list)
+    def __init__(self, demand_path, demands):
+        self.demand_path = demand_path
+        self.demands = demands
+        self.cand_paths = {}
+        
+    def get_paths(self, vnet_id, s_vr):
+        ''' the demands and paths of a candidate '''
+        key = (vnet_id, s_vr)
+        if key not in self.cand_paths:
+            self.cand_paths[key] = [(demand, self.demand_path[demand_id].values())
+                                    for demand_id, demand in self.demands[key]]
+        return self.cand_paths[key]
+        
+    def candidate_path(self, vnet_id, s_vr, state):
+        """
+        find a path for each demand of a candidate: the first of its paths
+        whose bottleneck (minimum) link capacity in state is larger than 
+        the demand, the last path if there is none. Return the number of 
+        demands without a path, and the path of the last demand
+        """
+        get_capacity = state.capacity.__getitem__
+        num_fail = 0
+        path = None
+        for demand, path_list in self.get_paths(vnet_id, s_vr):
+            for path in path_list:
+                if demand < min(map(get_capacity, path)):
+                    break
+            else:
+                num_fail += 1
+        return num_fail, path
     
     
-def get_obj_new(model_old, demand_path, slink_dict, demand_dict, w_a, w_b, theta, s_limit):
+def evaluate_selection(model, select_dict, w_a, w_b, theta, prep):
     """
-    get the objective value based on the heuristic selection
+    get the objective value of a standby selection {vnet_id: svr}:
+    the operation and connectivity cost of the selected standbys plus 
+    theta3 * the maximum utilization of the standby hosts
+    return (obj, max_util), ("infeasible", "none") if a failed vnet has 
+    no standby selected
     """
-    model = copy.deepcopy(model_old)
-    
-    #cpu_vector = model.cost_dict['cpu']
     dist_matrix = model.cost_dict['dist']
     rtt_matrix = model.cost_dict['rtt']
-    #bw_matrix = model.cost_dict['bw']
     w_a1, w_a2 = w_a
     w_b1, w_b2 = w_b
     theta1, theta2, theta3 = theta
-    # find total capacity and used bw on substrate nodes
-    node_port_list, used_bw_list = total_port(model)
-    #print "CHECK POINT-1", used_bw_list, node_port_list
-    vnet_info = model.get_vnet_info()
-    infeasible = 0
-
+    node_port_list = prep['node_port_list']
+    used_bw_list = prep['used_bw_list']
+    vnet_info = prep['vnet_info']
     fail_nodes = model.failed_dict
-    start_time = time.time()
-    select_dict, slink_dict = find_standby2(model, s_limit, w_a, w_b, theta, demand_path, demand_dict, slink_dict)
-    # random selection
-    #select_dict, slink_dict = find_random(model, s_limit, w_a, w_b, theta, demand_path, demand_dict, slink_dict)
-    #print "selection takes: ", time.time() - start_time
-    #print "Selected", select_dict
+    infeasible = 0
     sum_cost_1_2 = 0
     r_list = {}
     
@@ -662,11 +784,329 @@ def get_obj_new(model_old, demand_path, slink_dict, demand_dict, w_a, w_b, theta
     else:
         obj = "infeasible"
         max_util = "none"
+    return obj, max_util
+    
+    
+class local_search(object):
+    """
+    Local search state of a greedy standby selection: the selection, the 
+    allocated paths and link capacities, and the per-host utilization, 
+    traffic and count. A move relocates the standbys of some vnets to other
+    candidate hosts (one vnet: relocate, two vnets: swap), it is kept only
+    if it satisfies the constraints of find_standby2 (host limit, 
+    utilization threshold, a path with enough capacity for every demand)
+    and decreases the objective. The objective is updated incrementally:
+    connectivity cost by the change of the moved vnets, plus theta3 * the 
+    maximum utilization of the standby hosts
+    """
+    def __init__(self, model, select_dict, path_dict, slink_state, w_a, w_b, 
+                 theta, s_limit, prep, threshold=0.8):
+        dist_matrix = model.cost_dict['dist']
+        rtt_matrix = model.cost_dict['rtt']
+        w_a1, w_a2 = w_a
+        w_b1, w_b2 = w_b
+        theta1, theta2, theta3 = theta
+        fail_nodes = model.failed_dict
+        self.theta3 = theta3
+        self.s_limit = s_limit
+        self.threshold = threshold
+        self.paths = prep['path_table']
+        self.node_port_list = prep['node_port_list']
+        self.used_bw_list = prep['used_bw_list']
+        self.select_dict = dict(select_dict)
+        self.path_dict = path_dict
+        self.slink_state = slink_state
+        # cost of each candidate, traffic and bw demand of each failed vnet
+        self.vn_cost = {}
+        self.vn_traffic = {}
+        self.vn_req = {}
+        for vnet, traffic in prep['sorted_vn']:
+            j = vnet.vnet_id
+            f = fail_nodes[j]
+            if f == -1 or j not in select_dict:
+                continue
+            failed_node = vnet.vnodes[f]
+            self.vn_traffic[j] = traffic
+            self.vn_req[j] = sum(failed_node.neighbor_traffic.values())
+            self.vn_cost[j] = {}
+            for i in vnet.get_standby_ids():
+                cost = 0
+                for k in failed_node.vneighbors:
+                    dist_c = dist_cost(i, f, k, dist_matrix, w_a1, w_a2)
+                    rtt_c = rtt_cost(i, k, rtt_matrix)
+                    sigma = connect_cost(dist_c, rtt_c, w_b1, w_b2)
+                    cost += theta1 * operation_cost() + theta2 * sigma
+                self.vn_cost[j][i] = cost
+        self.vn_list = sorted(self.vn_cost)
+        self.svr_nodes = sorted(set([i for j in self.vn_list 
+                                     for i in self.vn_cost[j]]))
+        num_nodes = len(self.node_port_list)
+        self.host_util = [self.used_bw_list[i] / self.node_port_list[i] 
+                          for i in range(num_nodes)]
+        self.host_traffic = [0] * num_nodes
+        self.host_count = [0] * num_nodes
+        self.conn_cost = 0
+        for j in self.vn_list:
+            i = self.select_dict[j]
+            self.move_host(j, None, i)
+            self.conn_cost += self.vn_cost[j][i]
+            
+    def objective(self):
+        ''' the current objective value '''
+        max_util = max([self.host_util[i] for i in self.svr_nodes])
+        return self.conn_cost + self.theta3 * max_util
+        
+    def move_host(self, j, src, dst):
+        ''' move the standby of vnet j from host src (None: new) to dst '''
+        if src is not None:
+            self.host_util[src] -= self.vn_req[j] / self.node_port_list[src]
+            self.host_traffic[src] -= self.vn_traffic[j]
+            self.host_count[src] -= 1
+        self.host_util[dst] += self.vn_req[j] / self.node_port_list[dst]
+        self.host_traffic[dst] += self.vn_traffic[j]
+        self.host_count[dst] += 1
+        self.select_dict[j] = dst
+        
+    def change_path(self, path, traffic):
+        ''' add traffic to the capacity of the links of a path '''
+        self.slink_state.change_path(path, traffic)
+            
+    def alloc_path(self, j, i):
+        """
+        allocate the path of vnet j on host i in the same way as 
+        find_standby2, return None if a demand has no path
+        """
+        num_fail, path = self.paths.candidate_path(j, i, self.slink_state)
+        if num_fail > 0:
+            return None
+        self.change_path(path, -self.vn_traffic[j])
+        return path
+        
+    def feasible_host(self, i):
+        ''' host limit and utilization threshold of find_standby2 '''
+        utilization = (self.host_traffic[i] + self.used_bw_list[i]) / \
+                      self.node_port_list[i]
+        return self.host_count[i] <= self.s_limit and \
+               utilization < self.threshold
+        
+    def try_move(self, moves):
+        """
+        apply the moves [(vnet_id, new host)] if they are feasible and 
+        decrease the objective, return the change of the objective (0 if 
+        the moves are not applied)
+        """
+        old_obj = self.objective()
+        old_hosts = [(j, self.select_dict[j]) for j, dst in moves]
+        for j, src in old_hosts:
+            self.change_path(self.path_dict.get(j, []), self.vn_traffic[j])
+        for j, dst in moves:
+            self.move_host(j, self.select_dict[j], dst)
+        feasible = all([self.feasible_host(dst) for j, dst in moves])
+        new_paths = []
+        if feasible:
+            for j, dst in moves:
+                path = self.alloc_path(j, dst)
+                if path is None:
+                    feasible = False
+                    break
+                new_paths.append((j, path))
+        if feasible:
+            delta_conn = sum([self.vn_cost[j][dst] - self.vn_cost[j][src] 
+                              for (j, dst), (j, src) in zip(moves, old_hosts)])
+            self.conn_cost += delta_conn
+            delta = self.objective() - old_obj
+            if delta < -1e-12:
+                for j, path in new_paths:
+                    self.path_dict[j] = path
+                return delta
+            self.conn_cost -= delta_conn
+        # undo the moves
+        for j, path in new_paths:
+            self.change_path(path, self.vn_traffic[j])
+        for j, src in old_hosts:
+            self.move_host(j, self.select_dict[j], src)
+            self.change_path(self.path_dict.get(j, []), -self.vn_traffic[j])
+        return 0
+        
+    def run(self, time_budget):
+        """
+        relocate and swap moves until no move improves the objective or the
+        time budget (seconds) is used, return the trace [(time, obj)]
+        """
+        start_time = time.time()
+        trace = [(0, self.objective())]
+        improved = True
+        while improved and time.time() - start_time < time_budget:
+            improved = False
+            moves_list = []
+            for j in self.vn_list:
+                for dst in sorted(self.vn_cost[j]):
+                    moves_list.append([(j, dst)])
+            for index, j1 in enumerate(self.vn_list):
+                for j2 in self.vn_list[index + 1:]:
+                    moves_list.append([(j1, None), (j2, None)])
+            for moves in moves_list:
+                if time.time() - start_time >= time_budget:
+                    break
+                if len(moves) == 2:
+                    # swap the current hosts of the two vnets
+                    (j1, _), (j2, _) = moves
+                    host1, host2 = self.select_dict[j1], self.select_dict[j2]
+                    if host1 == host2 or host2 not in self.vn_cost[j1] or \
+                       host1 not in self.vn_cost[j2]:
+                        continue
+                    moves = [(j1, host2), (j2, host1)]
+                elif moves[0][1] == self.select_dict[moves[0][0]]:
+                    continue
+                if self.try_move(moves) < 0:
+                    improved = True
+                    trace.append((time.time() - start_time, self.objective()))
+        return trace
+    
+    
+def get_obj_new(model, demand_path, slink_dict, demand_dict, w_a, w_b, theta, s_limit, prep=None, improve_time=0, trace=None):
+    """
+    get the objective value based on the heuristic selection
+    The model, slink_dict, demand_path and demand_dict are only read, the 
+    paths are allocated on a copy of the link capacities (link_state), so 
+    one scenario can be evaluated for many (theta, limit) points
+    prep: the weight independent parts of the scenario, see prepare_scenario
+    improve_time: if positive, the greedy selection is improved by local 
+    search (see local_search) within improve_time seconds
+    trace: if a list is given, the (elapsed time, obj) points of the local 
+    search are appended to it
+    """
+    if prep is None:
+        prep = prepare_scenario(model, demand_dict, demand_path)
+
+    start_time = time.time()
+    slink_state = link_state(slink_dict)
+    path_dict = {}
+    select_dict, slink_state = find_standby2(model, s_limit, w_a, w_b, theta, demand_path, demand_dict, slink_state, prep, path_dict)
+    # random selection
+    #select_dict, slink_state = find_random(model, s_limit, w_a, w_b, theta, demand_path, demand_dict, slink_state, prep)
+    #print "selection takes: ", time.time() - start_time
+    #print "Selected", select_dict
+    obj, max_util = evaluate_selection(model, select_dict, w_a, w_b, theta, prep)
+    if improve_time > 0 and obj != "infeasible":
+        search = local_search(model, select_dict, path_dict, slink_state, 
+                              w_a, w_b, theta, s_limit, prep)
+        search_trace = search.run(improve_time)
+        select_dict = search.select_dict
+        obj, max_util = evaluate_selection(model, select_dict, w_a, w_b, theta, prep)
+        if trace is not None:
+            trace.extend(search_trace)
     #print obj
     used_time = time.time() - start_time
     return obj, select_dict, max_util, used_time
-
-
     
     
-
+def get_obj_grid(model, demand_path, slink_dict, demand_dict, grid, 
+                 improve_time=0, traces=None):
+    """
+    get the heuristic results of one failure scenario for a grid of 
+    weight and limit points
+    grid: a list of (w_a, w_b, theta, s_limit)
+    The weight independent parts (vnet order, candidate dist/rtt sums, 
+    demands, node bw) are computed once, see prepare_scenario. 
+    Return a list of (obj, select_dict, max_util, used_time) in the order 
+    of the grid, the time of the shared part is split evenly over the points
+    improve_time, traces: the local search time budget of each point, and 
+    a list to append the local search trace of each point to, see 
+    get_obj_new
+    """
+    start_time = time.time()
+    prep = prepare_scenario(model, demand_dict, demand_path)
+    prep_time = (time.time() - start_time) / max(len(grid), 1)
+    results = []
+    for w_a, w_b, theta, s_limit in grid:
+        trace = []
+        obj, select_dict, max_util, used_time = get_obj_new(model, demand_path, 
+                                                            slink_dict, 
+                                                            demand_dict, 
+                                                            w_a, w_b, theta, 
+                                                            s_limit, prep,
+                                                            improve_time, 
+                                                            trace)
+        results.append((obj, select_dict, max_util, used_time + prep_time))
+        if traces is not None:
+            traces.append(trace)
+    return results
+    
+    
+class vnode_state(object):
+    ''' the parts of a failed virtual router read by the heuristic '''
+    def __init__(self, vnode):
+        self.vnode_id = vnode.vnode_id
+        self.vneighbors = list(vnode.vneighbors)
+        self.neighbor_traffic = dict(vnode.neighbor_traffic)
+        
+        
+class vnet_state(object):
+    """
+    the parts of a virtual network read by the heuristic: the standby ids
+    and the failed virtual router, vnodes is {failed_id: vnode_state}
+    """
+    def __init__(self, vnet, failed_vr):
+        self.vnet_id = vnet.vnet_id
+        self.standby_ids = vnet.get_standby_ids()
+        self.vnodes = {}
+        if failed_vr != -1:
+            self.vnodes[failed_vr] = vnode_state(vnet.vnodes[failed_vr])
+            
+    def get_standby_ids(self):
+        ''' get standby router ids '''
+        return list(self.standby_ids)
+        
+        
+class scenario_state(object):
+    """
+    Compact copy of a failure scenario of the model, with only the parts 
+    read by the heuristic (failed routers, cost matrices, standby ids, 
+    vnode traffic and substrate state), to be sent to the worker processes 
+    instead of the whole model, see grid_task
+    """
+    def __init__(self, model):
+        self.failed_dict = dict(model.failed_dict)
+        self.cost_dict = {}
+        for key in ['dist', 'rtt', 'bw']:
+            self.cost_dict[key] = model.cost_dict[key]
+        self.vnets = [vnet_state(vnet, self.failed_dict[vnet.vnet_id]) 
+                      for vnet in model.vnets]
+        vnet_info = model.get_vnet_info()
+        self.vnet_info = {}
+        for vnet_id in vnet_info:
+            self.vnet_info[vnet_id] = {'standby': vnet_info[vnet_id]['standby'],
+                                       'traffic': vnet_info[vnet_id]['traffic']}
+        self.snet_state = model.snet_state
+        
+    def get_vnet_info(self):
+        ''' the virtual network information, see reconf_model '''
+        return self.vnet_info
+        
+        
+def grid_task(model, demand_path, slink_dict, demand_dict, grid, improve_time):
+    """
+    get_obj_grid as a worker process task, return (results, traces), 
+    traces is None if improve_time is 0
+    model is usually a scenario_state, the paths are allocated on a 
+    link_state copy of slink_dict, see get_obj_new
+    """
+    traces = None
+    if improve_time > 0:
+        traces = []
+    results = get_obj_grid(model, demand_path, slink_dict, demand_dict, grid, 
+                           improve_time, traces)
+    return results, traces
+    
+    
+def submit_grid(pool, model, demand_path, slink_dict, demand_dict, grid, 
+                improve_time=0):
+    """
+    submit the heuristic evaluation of one failure scenario to a 
+    multiprocessing pool, only the compact scenario state and link 
+    capacities are sent. Return the AsyncResult of grid_task
+    """
+    return pool.apply_async(grid_task, (scenario_state(model), demand_path, 
+                                        slink_dict, demand_dict, grid, 
+                                        improve_time))
@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+"""
+This module is to solve the dyn.mod formulation of a failure scenario
+with the HiGHS MILP solver of scipy (scipy.optimize.milp), without ampl,
+cplex and the log parsing of cplex_run.sh
+
+The formulation is the same as the lp file written by cplex_lp.py: the
+same variables (u, v, x, RR), objective and constraints, assembled as a
+sparse constraint matrix in the column order
+    u[j,f,i], v[j,f,i,k,k], x[d,q], RR
+see var_index. Constraints (1) IsStandby and (4) OneFPerS (one failure per
+virtual network) are the 0 <= u <= 1 bounds of the binary variables, and
+upRRbd is the upper bound of RR.
+
+build_milp only needs scipy.sparse, the problem it returns is a dictionary
+of arrays. scipy.optimize.milp needs scipy >= 1.9, which requires python 3,
+while create_model.py runs on python 2. So create_model.py --milp saves 
+the problem of each scenario next to its data file (see save_problem) and 
+lists the data files in <snet>-<ftype>-<n>-milp.lst, and this module 
+solves them under python 3:
+    python3 highs_milp.py [--time time_limit] <snet>-<ftype>-<n>-milp.lst
+which writes <snet>-<ftype>-<n>-milp.txt in the form of the heuristic obj 
+file: data file, obj, used time, RR, selection
+"""
+
+from __future__ import division
+import os
+import sys
+import time
+from optparse import OptionParser
+import numpy as np
+from scipy import sparse
+try:
+    from scipy.optimize import milp, LinearConstraint, Bounds
+except ImportError:
+    # scipy < 1.9
+    milp = None
+import cplex_lp
+
+
+class constraint_rows(object):
+    """
+    Rows of the sparse constraint matrix, lower <= A x <= upper,
+    added one row at a time as a list of (coefficient, column)
+    """
+    def __init__(self):
+        self.rows = []
+        self.cols = []
+        self.vals = []
+        self.lower = []
+        self.upper = []
+        self.names = []
+
+    def add(self, name, terms, lower, upper):
+        ''' add a row '''
+        row = len(self.lower)
+        for coef, col in terms:
+            self.rows.append(row)
+            self.cols.append(col)
+            self.vals.append(coef)
+        self.lower.append(lower)
+        self.upper.append(upper)
+        self.names.append(name)
+
+    def matrix(self, num_vars):
+        ''' the constraint matrix in csr format '''
+        return sparse.coo_matrix((self.vals, (self.rows, self.cols)),
+                                 shape=(len(self.lower), num_vars)).tocsr()
+
+
+def var_index(scenario, demand_path):
+    """
+    Column index of the variables:
+    u: {(j, f, i): col}, v: {(j, f, i, k): col}, x: {(d, q): col}, RR: col
+    in the order of the columns, with 1-based ids as in the ampl data file
+    """
+    index = {'u': {}, 'v': {}, 'x': {}}
+    col = 0
+    for vn in scenario:
+        j, f = vn['vn_id'], vn['fnode_id']
+        for i in vn['standby']:
+            index['u'][(j, f, i)] = col
+            col += 1
+    for vn in scenario:
+        j, f = vn['vn_id'], vn['fnode_id']
+        for i in vn['standby']:
+            for k, _ in vn['nbr']:
+                if k != i:
+                    index['v'][(j, f, i, k)] = col
+                    col += 1
+    for d in sorted(demand_path):
+        for q in sorted(demand_path[d]):
+            index['x'][(d, q)] = col
+            col += 1
+    index['RR'] = col
+    index['num_vars'] = col + 1
+    return index
+
+
+def objective_vector(model_f, scenario, index, w_a, w_b, theta):
+    """
+    Total_Cost: sum (m1 * eta + m2 * sigma) * v[j,f,i,k,k] + m3 * RR
+    see cplex_lp.write_objective
+    """
+    dist_matrix = model_f.cost_dict['dist']
+    rtt_matrix = model_f.cost_dict['rtt']
+    a1, a2 = w_a[0], w_a[1]
+    b1, b2 = w_b[0], w_b[1]
+    m1, m2, m3 = theta
+    # tau = 0, no ip reconfiguration
+    eta = 2 * (cplex_lp.DISABLE + cplex_lp.ENABLE)
+    cost = np.zeros(index['num_vars'])
+    for (j, f, i, k), col in index['v'].items():
+        sigma = b1 * (a1 * dist_matrix[i - 1, f - 1] +
+                      a2 * dist_matrix[i - 1, k - 1]) + \
+                b2 * rtt_matrix[i - 1, k - 1]
+        cost[col] = m1 * eta + m2 * sigma
+    cost[index['RR']] = m3
+    return cost
+
+
+def constraint_matrix(model_f, scenario, index, limit, slink_dict,
+                      demand_dict, demand_path):
+    """
+    Constraints (2), (3), (5) - (10) of dyn.mod, in the same way as
+    cplex_lp.write_constraints
+    """
+    num_port, sum_bw = cplex_lp.get_port_bw(model_f)
+    h_limit = cplex_lp.get_limit(model_f, limit)
+    u_col = index['u']
+    v_col = index['v']
+    x_col = index['x']
+    rr_col = index['RR']
+    rows = constraint_rows()
+    # Constraint (2)
+    for vn in scenario:
+        j, f = vn['vn_id'], vn['fnode_id']
+        for i in vn['standby']:
+            for k, _ in vn['nbr']:
+                if k != i:
+                    rows.add(('IsSelect', j, f, i, k, k),
+                             [(1, v_col[(j, f, i, k)]), (-1, u_col[(j, f, i)])],
+                             -np.inf, 0)
+    # Constraint (3)
+    for vn in scenario:
+        j, f = vn['vn_id'], vn['fnode_id']
+        rows.add(('OneSPerF', j, f),
+                 [(1, u_col[(j, f, i)]) for i in vn['standby']], 1, 1)
+    # Constraint (5)
+    host_select = {}
+    for vn in scenario:
+        j, f = vn['vn_id'], vn['fnode_id']
+        for i in vn['standby']:
+            host_select.setdefault(i, []).append((1, u_col[(j, f, i)]))
+    for i in sorted(host_select):
+        rows.add(('max_select', i), host_select[i], -np.inf, h_limit)
+    # Constraint (6)
+    for vn in scenario:
+        j, f = vn['vn_id'], vn['fnode_id']
+        for i in vn['standby']:
+            terms = [(1, v_col[(j, f, i, k)]) for k, _ in vn['nbr'] if k != i]
+            terms.append((-len(terms), u_col[(j, f, i)]))
+            rows.add(('IsConnect', j, f, i), terms, 0, 0)
+    # Constraint (7)
+    for vn in scenario:
+        j, f = vn['vn_id'], vn['fnode_id']
+        for i in vn['standby']:
+            terms = [(c, v_col[(j, f, i, k)])
+                     for k, c in vn['nbr'] if k != i and c != 0]
+            terms.append((-sum_bw[i], u_col[(j, f, i)]))
+            rows.add(('bw', i, j, f), terms, -np.inf, 0)
+    # Constraint (8)
+    host_traffic = {}
+    for vn in scenario:
+        j, f = vn['vn_id'], vn['fnode_id']
+        req_bw = sum([c for k, c in vn['nbr']])
+        for i in vn['standby']:
+            host_traffic.setdefault(i, [])
+            if req_bw != 0:
+                host_traffic[i].append((req_bw, u_col[(j, f, i)]))
+    for i in sorted(host_traffic):
+        terms = host_traffic[i] + [(-num_port[i], rr_col)]
+        rows.add(('res_util', i), terms, -np.inf, -(num_port[i] - sum_bw[i]))
+    # Constraint (9)
+    vn_index = {}
+    for vn in scenario:
+        vn_index[(vn['vn_id'], vn['fnode_id'])] = vn
+    for d in sorted(demand_dict):
+        demand = demand_dict[d]
+        j, f, i = demand['vn_id'], demand['fnode_id'], demand['svr']
+        if (j, f) not in vn_index or i == f:
+            continue
+        terms = [(1, x_col[(d, q)]) for q in sorted(demand_path[d])]
+        terms.append((-demand['capacity'], u_col[(j, f, i)]))
+        rows.add(('d_pair', d, j, f, i), terms, 0, 0)
+    # Constraint (10)
+    link_flow = {}
+    for d in sorted(demand_path):
+        for q in sorted(demand_path[d]):
+            for l in set(demand_path[d][q]):
+                link_flow.setdefault(l, []).append((1, x_col[(d, q)]))
+    for l in sorted(slink_dict):
+        if l in link_flow:
+            rows.add(('cl', l), link_flow[l], -np.inf,
+                     slink_dict[l]['capacity'])
+    return rows
+
+
+def build_milp(model_f, w_a, w_b, theta, limit, slink_dict, demand_dict,
+               demand_path):
+    """
+    Assemble the MILP of a failure scenario, the inputs are the same as
+    cplex_lp.write_lp. Return a dictionary with:
+    c: objective vector, A: constraint matrix (csr), lower, upper: the row
+    bounds, lb, ub: the variable bounds, integrality: 1 for u and v,
+    index: the column index, see var_index
+    """
+    scenario = cplex_lp.get_scenario(model_f)
+    index = var_index(scenario, demand_path)
+    num_vars = index['num_vars']
+    rows = constraint_matrix(model_f, scenario, index, limit, slink_dict,
+                             demand_dict, demand_path)
+    num_bin = len(index['u']) + len(index['v'])
+    lb = np.zeros(num_vars)
+    ub = np.full(num_vars, np.inf)
+    ub[:num_bin] = 1
+    ub[index['RR']] = cplex_lp.RR_BOUND
+    integrality = np.zeros(num_vars, dtype=int)
+    integrality[:num_bin] = 1
+    problem = {}
+    problem['c'] = objective_vector(model_f, scenario, index, w_a, w_b, theta)
+    problem['A'] = rows.matrix(num_vars)
+    problem['lower'] = np.array(rows.lower, dtype=float)
+    problem['upper'] = np.array(rows.upper, dtype=float)
+    problem['lb'] = lb
+    problem['ub'] = ub
+    problem['integrality'] = integrality
+    problem['index'] = index
+    return problem
+
+
+def save_problem(problem, file_name):
+    """
+    Save a problem assembled by build_milp in a npz file, the column index
+    is saved as arrays of keys and columns, so the file has no pickled 
+    objects and can be read by another python version, see load_problem
+    """
+    index = problem['index']
+    A = problem['A'].tocsr()
+    arrays = {}
+    for name in ['c', 'lower', 'upper', 'lb', 'ub', 'integrality']:
+        arrays[name] = problem[name]
+    arrays['A_data'] = A.data
+    arrays['A_indices'] = A.indices
+    arrays['A_indptr'] = A.indptr
+    arrays['A_shape'] = np.array(A.shape, dtype=int)
+    for name, key_len in [('u', 3), ('v', 4), ('x', 2)]:
+        keys = sorted(index[name], key=index[name].get)
+        arrays[name + '_key'] = np.array(keys, dtype=int).reshape(-1, key_len)
+        arrays[name + '_col'] = np.array([index[name][key] for key in keys],
+                                         dtype=int)
+    arrays['RR'] = np.array(index['RR'])
+    arrays['num_vars'] = np.array(index['num_vars'])
+    np.savez_compressed(file_name, **arrays)
+
+
+def load_problem(file_name):
+    ''' read a problem saved by save_problem '''
+    arrays = np.load(file_name)
+    problem = {}
+    for name in ['c', 'lower', 'upper', 'lb', 'ub', 'integrality']:
+        problem[name] = arrays[name]
+    problem['A'] = sparse.csr_matrix((arrays['A_data'], arrays['A_indices'],
+                                      arrays['A_indptr']),
+                                     shape=tuple(arrays['A_shape']))
+    index = {}
+    for name in ['u', 'v', 'x']:
+        keys = [tuple(key) for key in arrays[name + '_key'].tolist()]
+        index[name] = dict(zip(keys, arrays[name + '_col'].tolist()))
+    index['RR'] = int(arrays['RR'])
+    index['num_vars'] = int(arrays['num_vars'])
+    problem['index'] = index
+    arrays.close()
+    return problem
+
+
+def solve_problem(problem, time_limit=None):
+    """
+    Solve a problem assembled by build_milp with HiGHS. Return a
+    dictionary with:
+    status: the scipy milp status (0: optimal), message, obj (the string
+    "infeasible" if no solution is found), used_time,
+    u, v, x: the variable values in the order of index['u'], index['v'],
+    index['x'] columns, RR: the resource utilization,
+    select_dict: the selected standby of each failed vnet, {vnet_id: svr}
+    with 0-based svr, the same as the heuristic
+    """
+    if milp is None:
+        raise ImportError("scipy.optimize.milp (scipy >= 1.9, python 3) is required")
+    options = {}
+    if time_limit is not None:
+        options['time_limit'] = time_limit
+    start_time = time.time()
+    res = milp(problem['c'],
+               constraints=LinearConstraint(problem['A'], problem['lower'],
+                                            problem['upper']),
+               integrality=problem['integrality'],
+               bounds=Bounds(problem['lb'], problem['ub']),
+               options=options)
+    result = {}
+    result['status'] = res.status
+    result['message'] = res.message
+    result['used_time'] = time.time() - start_time
+    index = problem['index']
+    if res.x is None:
+        result['obj'] = "infeasible"
+        result['u'] = result['v'] = result['x'] = None
+        result['RR'] = None
+        result['select_dict'] = {}
+        return result
+    num_u = len(index['u'])
+    num_v = len(index['v'])
+    num_x = len(index['x'])
+    result['obj'] = res.fun
+    result['u'] = np.round(res.x[:num_u]).astype(int)
+    result['v'] = np.round(res.x[num_u:num_u + num_v]).astype(int)
+    result['x'] = res.x[num_u + num_v:num_u + num_v + num_x]
+    result['RR'] = res.x[index['RR']]
+    select_dict = {}
+    for (j, f, i), col in index['u'].items():
+        if result['u'][col] == 1:
+            select_dict[j] = i - 1
+    result['select_dict'] = select_dict
+    return result
+
+
+def solve(model_f, w_a, w_b, theta, limit, slink_dict, demand_dict,
+          demand_path, time_limit=None):
+    """
+    Solve the dyn.mod formulation of a failure scenario, see build_milp
+    and solve_problem
+    """
+    problem = build_milp(model_f, w_a, w_b, theta, limit, slink_dict,
+                         demand_dict, demand_path)
+    return solve_problem(problem, time_limit)
+
+
+def run(argv=None):
+    """
+    Solve the problems listed in a milp list file written by 
+    create_model.py --milp, the problem of a data file is the npz file 
+    with the same name in the directory of the list file. The results 
+    are written to the milp list file name with the extension .txt
+    """
+    if not argv:
+        argv = sys.argv[1:]
+    usage = "%prog [--time time_limit] milp_list"
+    parser = OptionParser(usage=usage)
+    parser.add_option("--time", dest="time_limit", type="float",
+                      default=None,
+                      help="the time limit in seconds of each solve")
+    (options, args) = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error("a milp list file is required")
+    if milp is None:
+        parser.error("scipy.optimize.milp (scipy >= 1.9, python 3) is required")
+    milp_list = args[0]
+    list_dir = os.path.dirname(milp_list)
+    milp_file = os.path.splitext(milp_list)[0] + '.txt'
+    fopen = open(milp_file, 'w')
+    fopen.write("MILP Obj Values \n")
+    for line in open(milp_list):
+        new_datafile = line.strip()
+        if not new_datafile:
+            continue
+        problem_file = os.path.join(list_dir, 
+                                    os.path.splitext(new_datafile)[0] + '.npz')
+        result = solve_problem(load_problem(problem_file), options.time_limit)
+        fopen.write(new_datafile + ', ' + \
+                    str(result['obj']) + ', ' + \
+                    str(result['used_time']) + ',' + \
+                    str(result['RR']) + ', ' + \
+                    str(result['select_dict']) + '\n')
+        fopen.flush()
+    fopen.close()
+
+
+if __name__ == '__main__':
+    run()
@@ -41,7 +41,22 @@ do
 		#echo $ampl_expand_file
 		cplex_file=$filename_base".lp"
 		#echo $cplex_file
-		( echo "model dyn.mod;"; echo "data $ampl_data_file;"; echo "expand;"; echo "quit;") | ampl > $ampl_expand_file
+		# skip the scenarios written by create_model.py --lp, a .lp file
+		# older than its data file is left from a previous run
+		if [ "$cplex_file" -nt "$ampl_data_file" ]
+		then
+			continue
+		fi
+		# an overlay data file (create_model.py --overlay) names its base
+		# data file on the first line, load the base data file first
+		base_data_file=`sed -n '1s/^# base data file: //p' $ampl_data_file`
+		if [ -n "$base_data_file" ]
+		then
+			data_cmd="data $base_data_file; data $ampl_data_file;"
+		else
+			data_cmd="data $ampl_data_file;"
+		fi
+		( echo "model dyn.mod;"; echo "$data_cmd"; echo "expand;"; echo "quit;") | ampl > $ampl_expand_file
 		#( echo "model dyn-old.mod;"; echo "data $ampl_data_file;"; echo "expand;"; echo "quit;") | ampl > $ampl_expand_file
 		python convert_ampl.py -r $ampl_expand_file -w $cplex_file  -b "['u','v']"
 		rm $ampl_expand_file
@@ -69,28 +69,11 @@ class Node(object):
     def __init__(self, node_id, status=0, num_iface=10):
         ''' Initialize a substrate node'''
         self.node_id = node_id
-        # maximum of VMs is self.cpu-1
-        self.cpu = 16
-        # self.ram = 64
-        # the utilization of the cpu, value is between 0 ~ 1
-        self.cpu_usage = 0
-        # the utilization of the memory, value is between 0 ~ 1
-        #self.ram_usage = 0
+        # the cpu and the bw of the interfaces are kept in snet_state
         self.num_iface = num_iface
-        self.iface_list = []
         # neighbor list is a list of tuple (neighbor_id, iface_id)
         self.neighbors = []
         self.geoinfo = (0.0, 0.0)
-        self.total_avail_bw = 0
-
-    def find_iface2neighbor(self, neighbor_id):
-        """
-        find the interface id that connects to the node's neighbor
-        """
-        for pair in self.neighbors:
-            if neighbor_id in pair:
-                return pair[1]
-                
         
     def set_neighbors(self, neighbor_list):
         """
@@ -98,40 +81,6 @@ class Node(object):
         """
         self.neighbors = neighbor_list
     
-    def set_res_utilize(self):
-        """
-        set resource utilization (cpu & memory)
-        """
-        # at least run 1 physical CPU core in the substrate node
-        self.cpu_usage = round(random.uniform(0, 1/self.cpu),5)
-        #self.ram_usage = round(random.uniform(0.2, 0.5),4)
-        return self.cpu_usage
-    
-    def set_total_avail_bw(self):
-        """
-        set the total avaialabe bandwidth at the node, only consider
-        the connected interfaces. self.num_iface, this is applied for the 
-        first time of adding a node to a topology
-        """
-        self.total_avail_bw = 1 * self.num_iface
-        
-        
-
-    def get_node_info(self):
-        ''' Get node information in the form of dictionary '''
-        node_info = {}
-        node_info['id'] = self.node_id
-        node_info['cpu'] = self.cpu_usage
-        #node_info['ram'] = self.ram_usage
-        node_info['num_iface'] = self.num_iface
-        node_info['neighbor'] = self.neighbors
-        node_info['geoinfo'] = self.geoinfo
-        node_info['sum_avail_bw'] = self.total_avail_bw
-        node_info['ifaces'] = {}
-        for iface in self.iface_list:
-            node_info['ifaces'][iface.iface_id] = iface.get_iface_info()
-        return node_info
-        
     def set_geoinfo(self, lat, lon):
         """
         set geographical information: latitude, longitude
@@ -148,16 +97,6 @@ class Node(object):
         
 
         
-    def add_phy_iface(self):
-        ''' Configure the physical interfaces '''
-        for index in range(self.num_iface):
-            iface = PhyInface(index)
-            iface.enable_iface
-            # first add an interface, no utilization, so avail_bw = link_bw
-            iface.update_avail_bw()
-            self.iface_list.append(iface)
-    
-
 #    def get_upIface(self):
 #        ''' Count the number of interfaces that are up '''
 #        up_ifaces = []
@@ -209,8 +148,147 @@ class Node(object):
 #        for iface in up_iface:
 #            self.total_avail_bw = self.total_avail_bw + iface.avail_bw
         #print "total", self.total_avail_bw
-        
-                
+
+
+class snet_state(object):
+    """
+    Array-backed state of the substrate network, it holds the residual
+    bandwidth and the cpu usage of all the substrate nodes instead of a
+    list of PhyInface objects on each Node:
+    indptr, nbr_ids: the adjacency in CSR form, the ports of node i are
+    indptr[i]:indptr[i+1], port p of node i connects to nbr_ids[indptr[i] + p]
+    link_bw, avail_bw: the capacity and the residual bw of each (node, port)
+    total_avail_bw: the total available bw of each node
+    cpu, cpu_usage: the cpu capacity and utilization of each node
+    port_map: {(node_id, neighbor_id): port}
+    hop_cache: {path: (hop_nodes, hop_index)}, see path_hops
+    """
+    def __init__(self, neighbor_lists, link_bw=1, cpu=16):
+        """
+        neighbor_lists: the neighbor ids of each node in the order of its
+        ports, the n-th list is the one of node n
+        """
+        num_nodes = len(neighbor_lists)
+        self.num_iface = numpy.array([len(nbrs) for nbrs in neighbor_lists],
+                                  dtype=int)
+        self.indptr = numpy.zeros(num_nodes + 1, dtype=int)
+        self.indptr[1:] = numpy.cumsum(self.num_iface)
+        self.nbr_ids = numpy.array([nbr for nbrs in neighbor_lists for nbr in nbrs],
+                                dtype=int)
+        self.link_bw = numpy.empty(len(self.nbr_ids))
+        self.link_bw.fill(link_bw)
+        # first add an interface, no utilization, so avail_bw = link_bw
+        self.avail_bw = self.link_bw.copy()
+        self.total_avail_bw = link_bw * self.num_iface.astype(float)
+        self.cpu = numpy.empty(num_nodes, dtype=int)
+        self.cpu.fill(cpu)
+        self.cpu_usage = numpy.zeros(num_nodes)
+        self.port_map = {}
+        for node_id in range(num_nodes):
+            for port, nbr in enumerate(neighbor_lists[node_id]):
+                self.port_map[(node_id, nbr)] = port
+        self.hop_cache = {}
+
+    def num_nodes(self):
+        ''' the number of substrate nodes '''
+        return len(self.num_iface)
+
+    def find_port(self, node_id, neighbor_id):
+        """
+        find the port of the node that connects to the node's neighbor,
+        None if they are not connected
+        """
+        return self.port_map.get((node_id, neighbor_id))
+
+    def get_avail_bw(self, node_id, port):
+        ''' get the available bw of a port '''
+        return float(self.avail_bw[self.indptr[node_id] + port])
+
+    def use_bw(self, node_id, port, usage):
+        ''' take the bw usage from a port and from the node's total '''
+        self.avail_bw[self.indptr[node_id] + port] -= usage
+        self.total_avail_bw[node_id] -= usage
+
+    def path_hops(self, path):
+        """
+        the (node, port) hops of a path of node ids, as the arrays 
+        hop_nodes: the node of each hop 
+        hop_index: the index of the port of each hop in avail_bw
+        each link of the path gives two hops, one on each end of the link
+        """
+        path_key = tuple(path)
+        if path_key not in self.hop_cache:
+            hop_nodes = []
+            hop_index = []
+            for index in range(len(path) - 1):
+                node_a, node_b = path[index], path[index + 1]
+                hop_nodes.extend([node_a, node_b])
+                hop_index.extend([self.indptr[node_a] + self.port_map[(node_a, node_b)],
+                                  self.indptr[node_b] + self.port_map[(node_b, node_a)]])
+            self.hop_cache[path_key] = (numpy.array(hop_nodes, dtype=int),
+                                        numpy.array(hop_index, dtype=int))
+        return self.hop_cache[path_key]
+
+    def path_feasible(self, hops, usage):
+        ''' check if every port on the hops has more available bw than usage '''
+        hop_nodes, hop_index = hops
+        return bool((self.avail_bw[hop_index] - usage > 0).all())
+
+    def use_path(self, hops, usage):
+        ''' take the bw usage from every port on the hops '''
+        hop_nodes, hop_index = hops
+        self.avail_bw[hop_index] -= usage
+        # a node in the middle of the path has two hops
+        numpy.subtract.at(self.total_avail_bw, hop_nodes, usage)
+
+    def link_capacity(self, src, dst):
+        ''' the available bw of the link from src to dst '''
+        return self.get_avail_bw(src, self.find_port(src, dst))
+
+    def set_res_utilize(self, node_id):
+        """
+        set the cpu utilization of a node
+        at least run 1 physical CPU core in the substrate node
+        """
+        self.cpu_usage[node_id] = round(random.uniform(0, 1/self.cpu[node_id]), 5)
+        return self.cpu_usage[node_id]
+
+    def bw_matrix(self):
+        """
+        the available bw of all the ports rounded to 5 digits, the rows are
+        ports and the columns are nodes, NaN for no such port
+        """
+        num_nodes = self.num_nodes()
+        bw_m = numpy.empty((max(self.num_iface), num_nodes))
+        bw_m.fill(numpy.nan)
+        ports = numpy.arange(len(self.nbr_ids)) - \
+                numpy.repeat(self.indptr[:-1], self.num_iface)
+        nodes = numpy.repeat(numpy.arange(num_nodes), self.num_iface)
+        bw_m[ports, nodes] = [round(bw, 5) for bw in self.avail_bw.tolist()]
+        return bw_m
+
+    def get_node_info(self, node_id):
+        """
+        Get node information in the form of dictionary, the same as
+        Node.get_node_info without the geoinfo
+        """
+        start = self.indptr[node_id]
+        nbrs = self.nbr_ids[start:self.indptr[node_id + 1]].tolist()
+        node_info = {}
+        node_info['id'] = node_id
+        node_info['cpu'] = float(self.cpu_usage[node_id])
+        node_info['num_iface'] = int(self.num_iface[node_id])
+        node_info['neighbor'] = [(nbr, port) for port, nbr in enumerate(nbrs)]
+        node_info['sum_avail_bw'] = float(self.total_avail_bw[node_id])
+        node_info['ifaces'] = {}
+        for port in range(len(nbrs)):
+            node_info['ifaces'][port] = {'iface_id': port,
+                                         'bb_bw': float(self.link_bw[start + port]),
+                                         'status': 1,
+                                         'avail_bw': float(self.avail_bw[start + port])}
+        return node_info
+
+
 # debug
                 
 def print_node_info(node_list):
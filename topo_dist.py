@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+This module is to get the geographical distance matrix (kkm) between all
+the nodes of a topology xml file.
+
+The matrix is computed in one pass over the coordinate arrays, with the same
+great-circle formula as topo_type.geocalc, and the result is cached in
+memory and on disk (DIST_PATH), keyed by the sha1 of the topology file. So a
+topology is only parsed and computed once, until the xml file changes.
+
+The diagonal of the matrix is NaN, the same as ampl_gen.geo_dist
+"""
+
+import os
+import hashlib
+import numpy as np
+import topo_xml
+
+# the same earth radius (km) as topo_type.geocalc
+EARTH_R = 6372.8
+DIST_PATH = 'topo_info/dist/'
+
+# in-memory cache, {sha1: dist_matrix}
+dist_cache = {}
+
+
+def file_hash(xml_file):
+    ''' sha1 of the topology file content '''
+    sha1 = hashlib.sha1()
+    with open(xml_file, 'rb') as fopen:
+        sha1.update(fopen.read())
+    return sha1.hexdigest()
+
+def geo_arrays(geo_info):
+    """
+    convert the geo information {node_id: (lat, lon)} into the latitude and
+    longitude arrays (radians), indexed by node id
+    """
+    num_nodes = len(geo_info)
+    lat = np.zeros(num_nodes)
+    lon = np.zeros(num_nodes)
+    for node_id in geo_info:
+        lat[node_id], lon[node_id] = geo_info[node_id]
+    return np.radians(lat), np.radians(lon)
+
+def geo_dist_matrix(geo_info):
+    """
+    get the geo-distance matrix (kkm, 4 decimals) of all node pairs, the
+    diagonal is NaN. This is topo_type.geocalc computed on the whole
+    coordinate arrays at once
+    """
+    lat, lon = geo_arrays(geo_info)
+    lat1 = lat[:, np.newaxis]
+    lat2 = lat[np.newaxis, :]
+    dlon = lon[:, np.newaxis] - lon[np.newaxis, :]
+    y = np.sqrt(
+        (np.cos(lat2) * np.sin(dlon)) ** 2
+        + (np.cos(lat1) * np.sin(lat2) -
+           np.sin(lat1) * np.cos(lat2) * np.cos(dlon)) ** 2
+        )
+    x = np.sin(lat1) * np.sin(lat2) + np.cos(lat1) * np.cos(lat2) * np.cos(dlon)
+    dist_matrix = np.round(EARTH_R * np.arctan2(y, x) / 1000, 4)
+    np.fill_diagonal(dist_matrix, np.nan)
+    return dist_matrix
+
+def cache_file(xml_file, digest):
+    ''' the cached matrix file of a topology '''
+    topo_name = os.path.splitext(os.path.basename(xml_file))[0]
+    return DIST_PATH + '%s-%s.npy' % (topo_name, digest[:16])
+
+def get_dist_matrix(xml_file):
+    """
+    get the geo-distance matrix of the topology xml file, from the cache
+    if the file has been seen before
+    """
+    digest = file_hash(xml_file)
+    if digest in dist_cache:
+        return dist_cache[digest]
+    dist_file = cache_file(xml_file, digest)
+    if os.path.exists(dist_file):
+        dist_matrix = np.load(dist_file)
+    else:
+        node_dict, link_dict, geo_info = topo_xml.run(xml_file)
+        dist_matrix = geo_dist_matrix(geo_info)
+        if not os.path.isdir(DIST_PATH):
+            try:
+                os.makedirs(DIST_PATH)
+            except OSError:
+                # created by another process
+                pass
+        # write then rename, so other processes never read a partial file
+        tmp_file = dist_file + '.%d.tmp' % os.getpid()
+        with open(tmp_file, 'wb') as fopen:
+            np.save(fopen, dist_matrix)
+        os.rename(tmp_file, dist_file)
+    dist_cache[digest] = dist_matrix
+    return dist_matrix
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+This module is to generate the candidate path sets of the link-path
+parameters: up to K loop-free shortest (hop count) paths between every pair
+of substrate nodes, computed with networkx shortest_simple_paths (Yen).
+
+The path sets are computed once per topology and cached in memory and on
+disk (PATH_PATH), keyed by the sha1 of the substrate link list. The cache
+file is an npz with the paths stored as flat arrays:
+pair: (src, dst) of each path, src < dst
+path_id: the path id (starting from 1) of each path within its node pair
+hop_ptr: the nodes of path n are nodes[hop_ptr[n]:hop_ptr[n+1]]
+nodes: the node ids of all paths
+
+All node ids are 1-based, the same as the ampl data file.
+
+It also keeps the catalog of all the shortest paths between the substrate
+nodes (shortest_catalog), which create_model uses to allocate the virtual
+links on the substrate. Those paths use the 0-based node ids of the model.
+"""
+
+import os
+import hashlib
+from itertools import islice
+import numpy as np
+import networkx as nx
+
+# default number of paths per node pair
+K_PATHS = 3
+PATH_PATH = 'topo_info/path/'
+
+# in-memory cache, {(sha1, k): path_catalog}
+path_cache = {}
+# in-memory cache, {sha1: shortest_catalog}
+shortest_cache = {}
+
+
+def topo_hash(snet_topo):
+    ''' sha1 of the sorted substrate link list '''
+    links = sorted([(min(link), max(link)) for link in snet_topo.edges()])
+    sha1 = hashlib.sha1()
+    sha1.update(str(links).encode())
+    return sha1.hexdigest()
+
+def k_shortest_paths(snet_topo, k):
+    """
+    compute up to k loop-free shortest paths for all node pairs, as
+    {(src, dst): [[node, node, ...], ...]}, src < dst, 1-based node ids
+    """
+    path_catalog = {}
+    nodes = sorted(snet_topo.nodes())
+    for src in nodes:
+        for dst in nodes:
+            if src < dst and nx.has_path(snet_topo, src, dst):
+                paths = islice(nx.shortest_simple_paths(snet_topo, src, dst), k)
+                path_catalog[(src + 1, dst + 1)] = \
+                    [[node + 1 for node in path] for path in paths]
+    return path_catalog
+
+def save_catalog(path_catalog, path_file):
+    ''' save the path catalog in the flat array format '''
+    pair = []
+    path_id = []
+    hop_ptr = [0]
+    nodes = []
+    for d_pair in sorted(path_catalog):
+        for index, path in enumerate(path_catalog[d_pair]):
+            pair.append(d_pair)
+            path_id.append(index + 1)
+            nodes.extend(path)
+            hop_ptr.append(len(nodes))
+    if not os.path.isdir(PATH_PATH):
+        try:
+            os.makedirs(PATH_PATH)
+        except OSError:
+            # created by another process
+            pass
+    # write then rename, so other processes never read a partial file
+    tmp_file = path_file + '.%d.tmp' % os.getpid()
+    with open(tmp_file, 'wb') as fopen:
+        np.savez_compressed(fopen,
+                            pair=np.array(pair, dtype=np.int32).reshape(-1, 2),
+                            path_id=np.array(path_id, dtype=np.int32),
+                            hop_ptr=np.array(hop_ptr, dtype=np.int64),
+                            nodes=np.array(nodes, dtype=np.int32))
+    os.rename(tmp_file, path_file)
+
+def load_catalog(path_file):
+    ''' load a path catalog saved by save_catalog '''
+    data = np.load(path_file)
+    pair = data['pair']
+    hop_ptr = data['hop_ptr']
+    nodes = data['nodes'].tolist()
+    path_catalog = {}
+    for index in range(len(pair)):
+        d_pair = (int(pair[index][0]), int(pair[index][1]))
+        path = nodes[hop_ptr[index]:hop_ptr[index + 1]]
+        path_catalog.setdefault(d_pair, []).append(path)
+    data.close()
+    return path_catalog
+
+def get_path_catalog(snet_topo, snet_type, k=K_PATHS):
+    """
+    get the k-shortest path catalog of the substrate topology (see
+    k_shortest_paths), from the cache if the topology has been seen before
+    """
+    digest = topo_hash(snet_topo)
+    if (digest, k) in path_cache:
+        return path_cache[(digest, k)]
+    path_file = PATH_PATH + '%s-%dpath-%s.npz' % (snet_type, k, digest[:16])
+    if os.path.exists(path_file):
+        path_catalog = load_catalog(path_file)
+    else:
+        path_catalog = k_shortest_paths(snet_topo, k)
+        save_catalog(path_catalog, path_file)
+    path_cache[(digest, k)] = path_catalog
+    return path_catalog
+
+
+class shortest_catalog(object):
+    """
+    All the shortest paths between the node pairs of a substrate topology,
+    {(src, dst): [[node, node, ...], ...]}, 0-based node ids. The paths of 
+    a pair are enumerated by nx.all_shortest_paths the first time they are
+    asked for, and kept in the same order. The pairs are ordered, 
+    (src, dst) and (dst, src) are enumerated separately
+    """
+    def __init__(self, snet_topo):
+        self.snet_topo = snet_topo
+        self.paths = {}
+        
+    def get_paths(self, src, dst):
+        ''' get all the shortest paths from src to dst '''
+        if (src, dst) not in self.paths:
+            self.paths[(src, dst)] = list(nx.all_shortest_paths(self.snet_topo, 
+                                                                src, dst))
+        return self.paths[(src, dst)]
+
+def get_shortest_catalog(snet_topo):
+    """
+    get the shortest path catalog of the substrate topology, the same 
+    catalog is shared by all the models of the same topology
+    """
+    digest = topo_hash(snet_topo)
+    if digest not in shortest_cache:
+        shortest_cache[digest] = shortest_catalog(snet_topo)
+    return shortest_cache[digest]
@@ -5,8 +5,9 @@ This scripts is to create virtual router class
 @author: xuanliu
 """
 
-from substrate import PhyInface, Node
+from substrate import PhyInface
 import networkx as nx
+import numpy as np
 import random 
 
 
@@ -34,8 +35,16 @@ class virtual_iface(PhyInface):
         self.used_bw = self.utilize * self.default_bw
     
 
-class virtual_node(Node):
-    ''' virtual node class that inherits from Node class'''
+class virtual_node(object):
+    """
+    virtual node class, with the same attributes as the substrate Node it
+    is created on. The attributes are slots, and the virtual interfaces 
+    are implicit: a virtual_iface is only created when it is enabled, 
+    vifaces is {viface_id: virtual_iface} of the enabled interfaces
+    """
+    __slots__ = ['vnode_id', 'status', 'num_viface', 'vifaces', 'cpu', 'ram',
+                 'iface_bw', 'vneighbors', 'total_traffic', 'neighbor_traffic']
+    
     def __init__(self, vnode_id, status=0, num_viface=10):
         """
         Initialize virtual node object
@@ -47,7 +56,7 @@ class virtual_node(Node):
         self.vnode_id = vnode_id
         self.status = status
         self.num_viface = num_viface
-        self.viface_list = []
+        self.vifaces = {}
         self.cpu = 0
         self.ram = 0
         self.iface_bw = 0.0
@@ -84,55 +93,37 @@ class virtual_node(Node):
         
     def conf_viface(self):
         """
-        Configure the virtual interfaces, populate virtual interface list
+        Configure the virtual interfaces. 
         Each virtual router has the same number of virtual interfaces, which 
-        equals to the total number of substrate nodes. 
+        equals to the total number of substrate nodes (num_viface). They are
+        all down, and no interface object is created until it is enabled
         """
-        # num_viface is the total number of substrate nodes. 
-        for index in range(self.num_viface):
-            self.viface_list.append(virtual_iface(index, self.iface_bw))
+        self.vifaces = {}
 
-    def enable_iface(self, iface_list, num):
+    def enable_iface(self, num):
         ''' Enable the virtual interface based on the virtual topology '''
-        if num > len(self.viface_list):
+        if num > self.num_viface:
             return "The router does not have enough interfaces."
         else:
-            up_ifaces = self.get_upIface()
-            down_ifaces = self.get_downIface(up_ifaces)
-            if num > len(down_ifaces):
+            down_ids = self.get_down_ids()
+            if num > len(down_ids):
                 return "The router does not have enough interfaces."
             else:
-                pick_ifaces = random.sample(set(down_ifaces), num)
-                for item in pick_ifaces:
-                    item.status = 1
-                self.update_iface_list(pick_ifaces)
+                # sampled from a set as before, which draws the same random
+                # numbers, so the seeded models do not change
+                pick_ids = random.sample(set(down_ids), num)
+                for viface_id in pick_ids:
+                    self.vifaces[viface_id] = virtual_iface(viface_id, 
+                                                            self.iface_bw, 1)
     
     def get_upIface(self):
-        ''' Count the number of interfaces that are up '''
-        up_ifaces = []
-        for item in self.viface_list:
-            if item.status == 1:
-                up_ifaces.append(item)
-        return up_ifaces
-    
-    def get_downIface(self, up_ifaces):
-        ''' return the number'''
-        down_ifaces = set(self.viface_list) - set(up_ifaces) 
-        return list(down_ifaces)
-        
-    def update_iface_list(self, new_iface_list):
-        ''' udpate iface stats '''
-        for item in self.viface_list:
-            if item in new_iface_list:
-                temp = self.find_iface(new_iface_list, item.viface_id)
-                item.update(temp.status)
+        ''' get the interfaces that are up '''
+        return [self.vifaces[viface_id] for viface_id in sorted(self.vifaces)]
     
-    def find_iface(self, iface_list, target_id):
-        ''' find the target in the list '''
-        for item in iface_list:
-            if item.viface_id == target_id:
-                return item
-
+    def get_down_ids(self):
+        ''' get the ids of the interfaces that are down '''
+        return [viface_id for viface_id in range(self.num_viface) 
+                if viface_id not in self.vifaces]
     
     def get_used_bw_list(self):
         """ 
@@ -141,7 +132,7 @@ class virtual_node(Node):
         only return a list of non-zero bw
         """
         used_bw_list = []
-        for viface in self.viface_list:
+        for viface in self.get_upIface():
             if viface.used_bw != 0:
                 used_bw_list.append(viface.used_bw)
         return used_bw_list
@@ -150,6 +141,9 @@ class virtual_node(Node):
         
 class vnet(object):
     ''' virtual network class '''
+    __slots__ = ['vnodes', 'standby_vnodes', 'vtopo', 'vnet_id', 
+                 'nonactive_vnodes', 'adj_matrix', 'adj_topo', 'adj_size']
+    
     def __init__(self, vnodes = [], vn_id = 0):
         """ 
         initalize a virtual network 
@@ -161,6 +155,10 @@ class vnet(object):
         self.vtopo = nx.Graph()
         self.vnet_id = vn_id
         self.nonactive_vnodes = []
+        # adjacency matrix cache, see get_adj_matrix
+        self.adj_matrix = None
+        self.adj_topo = None
+        self.adj_size = None
   
 
     def set_traffic(self, node_id, dst_id, volume):
@@ -230,6 +228,26 @@ class vnet(object):
             vnode_traffic.append((vnode.vnode_id, vnode.total_traffic))
         return vnode_traffic
         
+    def get_adj_matrix(self):
+        """
+        return the symmetric adjacency matrix (N x N, 0/1) of the virtual
+        network over all its vnodes, built from the edge array of vtopo.
+        It is cached until vtopo is replaced, or the number of its edges 
+        or of the vnodes changes
+        """
+        adj_size = (self.vtopo.number_of_edges(), len(self.vnodes))
+        if self.adj_matrix is None or self.adj_topo is not self.vtopo or \
+                self.adj_size != adj_size:
+            num_nodes = len(self.vnodes)
+            adj = np.zeros((num_nodes, num_nodes), dtype=np.int8)
+            edges = np.array(self.vtopo.edges(), dtype=int).reshape(-1, 2)
+            adj[edges[:, 0], edges[:, 1]] = 1
+            adj[edges[:, 1], edges[:, 0]] = 1
+            self.adj_matrix = adj
+            self.adj_topo = self.vtopo
+            self.adj_size = adj_size
+        return self.adj_matrix
+        
     def get_vnet_info(self):
         ''' get virtual network information '''
         vnet_dict = {}